@@ -0,0 +1,187 @@
+import atexit
+import copy
+import fcntl
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from django.core import mail
+from django.utils.log import AdminEmailHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """
+    Log file handler rotating the file when it reaches maxBytes and compressing the rotated files with gzip, so the
+    logs take at most about maxBytes * (backupCount + 1) of disk.
+    Several processes (e.g. gunicorn workers) can write the same file: only one of them rotates it, holding a lock
+    file, and the others reopen the new file.
+    """
+
+    def __init__(self, filename, maxBytes, backupCount, encoding='utf-8'):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, destination: str):
+        with open(source, 'rb') as source_file, gzip.open(destination, 'wb') as destination_file:
+            shutil.copyfileobj(source_file, destination_file)
+        os.remove(source)
+
+    def _rotated_by_other_process(self) -> bool:
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def shouldRollover(self, record) -> bool:
+        if self.stream is not None and self._rotated_by_other_process():
+            self.stream.close()
+            self.stream = None
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.stream is not None and self._rotated_by_other_process():
+                # rotated by another process while waiting for the lock
+                self.stream.close()
+                self.stream = None
+                return
+            super().doRollover()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler putting the records into a bounded queue for a QueueListener thread, so logging never waits for
+    a file or an email. The records are dropped while the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record):
+        """
+        Overriding the prepare method to keep the exception info and the request of the record for the handlers
+        (e.g. the HTML report of AdminEmailHandler). The message is merged on the logging thread, as its arguments
+        can change later.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AggregatingAdminEmailHandler(AdminEmailHandler):
+    """
+    Admin email handler sending an email only for the first rate_limit records of the same kind (fingerprint) in
+    every interval (in seconds). The other records are counted and reported in one summary email at the end of the
+    interval, so a flood of the same warning sends only a few emails.
+    """
+
+    def __init__(self, interval=600, rate_limit=1, include_html=False, email_backend=None, reporter_class=None):
+        super().__init__(include_html=include_html, email_backend=email_backend, reporter_class=reporter_class)
+        self.interval = interval
+        self.rate_limit = rate_limit
+        self._window_started = time.monotonic()
+        # fingerprint -> [sent emails, suppressed records, last suppressed record] in the current interval
+        self._occurrences = {}
+        self._timer = None
+
+    @staticmethod
+    def fingerprint(record) -> tuple:
+        """
+        Returns the kind of the record: where it was logged and the type of its exception. The message is not part
+        of it, as it often contains the values of the request (e.g. an invalid token).
+        """
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        return record.name, record.levelno, record.pathname, record.lineno, exc_type
+
+    def emit(self, record):
+        with self.lock:
+            if time.monotonic() - self._window_started >= self.interval:
+                self.send_summary()
+            occurrences = self._occurrences.setdefault(self.fingerprint(record), [0, 0, None])
+            if occurrences[0] >= self.rate_limit:
+                occurrences[1] += 1
+                occurrences[2] = record
+                self._schedule_summary()
+                return
+            occurrences[0] += 1
+        super().emit(record)
+
+    def _schedule_summary(self):
+        # the timer thread does not exist in a forked process
+        if self._timer is None or not self._timer.is_alive():
+            delay = max(self.interval - (time.monotonic() - self._window_started), 0)
+            self._timer = threading.Timer(delay, self.send_summary)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def send_summary(self):
+        """
+        Sends the summary of the suppressed records of the current interval, and starts a new interval.
+        """
+        with self.lock:
+            minutes = max(round((time.monotonic() - self._window_started) / 60), 1)
+            suppressed = [(count, record) for _sent, count, record in self._occurrences.values() if count]
+            self._window_started = time.monotonic()
+            self._occurrences = {}
+        if not suppressed:
+            return
+        lines = ['{} occurrences in the last {} minutes of {} ({}:{}), the last one:\n{}\n'.format(
+                     count, minutes, record.levelname, record.pathname, record.lineno, self.format(record))
+                 for count, record in sorted(suppressed, key=lambda item: item[0], reverse=True)]
+        subject = '{} repeated log records in the last {} minutes'.format(sum(count for count, _ in suppressed),
+                                                                          minutes)
+        mail.mail_admins(subject, '\n'.join(lines), fail_silently=True, connection=self.connection())
+
+    def close(self):
+        """
+        Overriding the close method to send the summary of the suppressed records at exit.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self.send_summary()
+        super().close()
+
+
+def start_logging_queue(logger_name: str, queue_size: int) -> QueueListener:
+    """
+    Moves the handlers of the logger to a QueueListener thread, the logger only puts the records into a queue.
+    The thread is stopped at exit after handling the records in the queue, and it is restarted in the processes
+    forked after this call (e.g. gunicorn workers with preload_app).
+    """
+    logger = logging.getLogger(logger_name)
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    os.register_at_fork(after_in_child=lambda: _restart_listener(listener))
+    return listener
+
+
+def _stop_listener(listener: QueueListener):
+    if listener._thread is not None:
+        listener.stop()
+
+
+def _restart_listener(listener: QueueListener):
+    # the thread of the listener does not exist in a forked process
+    listener._thread = None
+    listener.start()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import os
 import sys
+import tempfile
 from django.utils.translation import gettext_lazy as _
 from django.utils.log import AdminEmailHandler
 import logging.config
@@ -20,6 +21,7 @@ import logging.config
 # Whether the tests are being run
 TEST_MODE = len(sys.argv) > 1 and sys.argv[1] == 'test'
 
+from .log_handlers import start_logging_queue
 from .utils import load_config
 
 
@@ -54,6 +56,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'hajni_courses_app.middleware.StaticFilesMiddleware',
+    'hajni_courses_app.middleware.MetricsMiddleware',
+    'hajni_courses_app.middleware.SlowRequestProfilerMiddleware',
+    'hajni_courses_app.middleware.QueryInspectorMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -147,6 +153,13 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 STATICFILES_DIRS = [
     # BASE_DIR / "static",
 ]
+# collectstatic saves content hashed and precompressed (gzip, Brotli) copies of the static files
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'hajni_courses_app.storage.CompressedManifestStaticFilesStorage'},
+}
+if TEST_MODE:
+    STORAGES['staticfiles'] = {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -156,8 +169,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # custom settings
 
+SESSION_ENGINE = 'hajni_courses_app.session_backend'
 SESSION_COOKIE_AGE = 604800  # 1 week
 SESSION_SAVE_EVERY_REQUEST = True
+# an unchanged session is written again only after this fraction of SESSION_COOKIE_AGE, the sessions are cached
+SESSION_REFRESH_FRACTION = 0.1
 
 AUTH_USER_MODEL = 'hajni_courses_app.CustomUser'
 
@@ -165,19 +181,63 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
 
+# the worker processes write their request metrics here, /metrics sums them; None disables the metrics
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+if TEST_MODE:
+    METRICS_DIR = None
+# besides the staff users, /metrics is available with the "Authorization: Bearer <METRICS_TOKEN>" header
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# a PROFILING_SAMPLE_RATE fraction of the requests is profiled (0 turns it off), and the reports of the ones slower
+# than PROFILING_THRESHOLD seconds are saved, keeping the last PROFILING_MAX_FILES of them
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_THRESHOLD = float(os.environ.get('PROFILING_THRESHOLD', 1))
+PROFILING_DIR = os.path.join(BASE_DIR, 'logs', 'profiles')
+PROFILING_MAX_FILES = 100
+
+# with SQL_INSPECTION_ENABLED (always in the tests), the queries slower than SQL_SLOW_QUERY_THRESHOLD seconds are
+# logged, and so are the queries repeated at least SQL_REPEATED_QUERY_THRESHOLD times within a request (N+1 queries),
+# which fail the tests
+SQL_INSPECTION_ENABLED = TEST_MODE or os.environ.get('SQL_INSPECTION_ENABLED', 'false').lower() == 'true'
+SQL_SLOW_QUERY_THRESHOLD = float(os.environ.get('SQL_SLOW_QUERY_THRESHOLD', 0.5))
+SQL_REPEATED_QUERY_THRESHOLD = 5
+SQL_REPEATED_QUERY_RAISE = TEST_MODE
+
+# the file based cache is shared by all the worker processes of the host
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+    }
+}
+# the lock files of the cache entries being regenerated, see get_or_render
+CACHE_LOCK_DIR = os.path.join(CACHES['default']['LOCATION'], 'locks')
+if TEST_MODE:
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    CACHE_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'hajni_courses_cache_locks')
+
 MEDIA_ROOT = os.path.abspath(os.path.join(BASE_DIR, 'hajni_courses_app', 'media'))
 MEDIA_URL = '/media/'
+# the downloads are sent by the front-end server after the login check: 'nginx' (X-Accel-Redirect),
+# 'apache' (X-Sendfile) or None to send them from Django
+DOWNLOADS_SENDFILE_BACKEND = os.environ.get('DOWNLOADS_SENDFILE_BACKEND') or None
+# the internal nginx location serving MEDIA_ROOT
+DOWNLOADS_ACCEL_REDIRECT_PREFIX = '/protected-media/'
 
 
 # logging
 
 LOGGING_CONFIG = None
+LOGGING_QUEUE_SIZE = 10000  # log records waiting for the handlers, more of them are dropped
 email_config = load_config().get('hajni_courses_email', {})
 
 MAILERSEND_API_KEY = os.environ.get('MAILERSEND_API_KEY', email_config.get('mailersend_api_key'))
 EMAIL_FROM_NAME = 'Képzés Mindenkinek!'
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_SUBJECT_PREFIX = 'Képzés Mindenkinek! - '
+# emails sent in the background share a bounded thread pool per process
+EMAIL_EXECUTOR_MAX_WORKERS = 4
+EMAIL_EXECUTOR_QUEUE_SIZE = 100
 if email_config.get('admins') and email_config.get('sender'):
     DEFAULT_FROM_EMAIL = email_config.get('sender')
     ADMINS = [(name, email) for name, email in email_config.get('admins').items()]
@@ -195,13 +255,18 @@ LOGGING = {
     "handlers": {
         "file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "class": "hajni_courses.log_handlers.CompressedRotatingFileHandler",
             "filename": "logs/general.log",
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
             "formatter": "generic",
         },
         "mail_admins": {
             "level": "WARNING",
-            "class": "django.utils.log.AdminEmailHandler",
+            "class": "hajni_courses.log_handlers.AggregatingAdminEmailHandler",
+            # one email per kind of record in 10 minutes, the others are counted in a summary email
+            "interval": 10 * 60,
+            "rate_limit": 1,
             "include_html": True,
             "formatter": "generic",
         },
@@ -216,3 +281,5 @@ LOGGING = {
 }
 
 logging.config.dictConfig(LOGGING)
+# the handlers run in a background thread, logging in a request does not wait for the file or the emails
+start_logging_queue('hajni_courses_logger', queue_size=LOGGING_QUEUE_SIZE)
@@ -1,10 +1,19 @@
+import gzip
+import logging
+import os
+import queue
+import tempfile
+import threading
 import unittest
 from unittest.mock import mock_open, patch, Mock, MagicMock
+from django.core import mail
 from django.test import TestCase
 from mailersend.exceptions import MailerSendError
 
 from . import settings
-from .utils import load_config, HajniCoursesEmail
+from .log_handlers import (AggregatingAdminEmailHandler, CompressedRotatingFileHandler, NonBlockingQueueHandler,
+                           start_logging_queue)
+from .utils import load_config, BoundedExecutor, HajniCoursesEmail
 
 
 class ProjectUtilsTestCase(unittest.TestCase):
@@ -33,6 +42,149 @@ class ProjectUtilsTestCase(unittest.TestCase):
         self.assertDictEqual(config, {})
 
 
+class BoundedExecutorTestCase(unittest.TestCase):
+    """
+    Test cases for the BoundedExecutor class.
+    """
+
+    def test_01_submit_when_full(self):
+        """Tests that a non-blocking submit returns None when all the slots are taken."""
+        executor = BoundedExecutor(max_workers=1, queue_size=1)
+        release = threading.Event()
+        futures = [executor.submit(release.wait), executor.submit(release.wait)]
+        self.assertIsNone(executor.submit(release.wait, block=False))
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        # the slots are freed once the tasks are done
+        self.assertIsNotNone(executor.submit(lambda: None, block=False))
+        executor.shutdown()
+
+    def test_02_shutdown_drains(self):
+        """Tests that the shutdown waits for the queued tasks."""
+        executor = BoundedExecutor(max_workers=1, queue_size=10)
+        done = []
+        for i in range(5):
+            executor.submit(done.append, i)
+        executor.shutdown()
+        self.assertEqual(done, [0, 1, 2, 3, 4])
+
+
+class LogHandlersTestCase(unittest.TestCase):
+    """
+    Test cases for the rotating log file and the logging queue.
+    """
+
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.log_file = os.path.join(log_dir.name, 'general.log')
+
+    def _handler(self):
+        handler = CompressedRotatingFileHandler(self.log_file, maxBytes=100, backupCount=2)
+        self.addCleanup(handler.close)
+        return handler
+
+    @staticmethod
+    def _record(message, *args):
+        return logging.makeLogRecord({'msg': message, 'args': args, 'levelno': logging.INFO})
+
+    def test_01_rotated_files_compressed(self):
+        """Tests that the rotated files are compressed and only backupCount of them are kept."""
+        handler = self._handler()
+        for i in range(20):
+            handler.handle(self._record('message %02d %s', i, 'x' * 30))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.log_file))),
+                         ['general.log', 'general.log.1.gz', 'general.log.2.gz', 'general.log.lock'])
+        with gzip.open(self.log_file + '.1.gz', 'rt') as rotated_file:
+            self.assertIn('message 17', rotated_file.read())
+
+    def test_02_file_rotated_by_other_process(self):
+        """Tests that a handler reopens the log file rotated by another handler."""
+        first_handler, second_handler = self._handler(), self._handler()
+        first_handler.handle(self._record('first'))
+        second_handler.handle(self._record('second'))
+        first_handler.handle(self._record('x' * 100))
+        first_handler.handle(self._record('after rotation'))
+        second_handler.handle(self._record('second after rotation'))
+        with open(self.log_file) as log_file:
+            self.assertEqual(log_file.read(), 'after rotation\nsecond after rotation\n')
+
+    def test_03_logging_queue(self):
+        """Tests that the handlers of the logger run in the listener thread with the exception info kept."""
+        logging.disable(logging.NOTSET)
+        self.addCleanup(logging.disable, logging.CRITICAL)
+        test_logger = logging.getLogger('hajni_courses_test_logger')
+        test_logger.propagate = False
+        handler = Mock(level=logging.WARNING)
+        test_logger.addHandler(handler)
+        listener = start_logging_queue('hajni_courses_test_logger', queue_size=10)
+        self.addCleanup(test_logger.handlers.clear)
+        self.assertIsInstance(test_logger.handlers[0], NonBlockingQueueHandler)
+        arguments = ['argument']
+        try:
+            raise ValueError('error')
+        except ValueError:
+            test_logger.exception('message with %s', arguments)
+        arguments.append('changed')
+        test_logger.info('not handled below WARNING')
+        listener.stop()
+        handler.handle.assert_called_once()
+        record = handler.handle.call_args[0][0]
+        self.assertEqual(record.getMessage(), "message with ['argument']")
+        self.assertIs(record.exc_info[0], ValueError)
+
+    def test_04_logging_queue_full(self):
+        """Tests that the records are dropped while the queue is full."""
+        queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+        for i in range(5):
+            queue_handler.handle(self._record('message %s', i))
+        self.assertEqual(queue_handler.queue.qsize(), 2)
+        self.assertEqual(queue_handler.dropped, 3)
+
+
+class AggregatingAdminEmailHandlerTestCase(TestCase):
+    """
+    Test cases for the AggregatingAdminEmailHandler class.
+    """
+
+    def setUp(self):
+        self.enterContext(self.settings(ADMINS=[('Admin', 'admin@mail.com')]))
+
+    @staticmethod
+    def _record(message, lineno=96):
+        return logging.makeLogRecord({'msg': message, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                      'pathname': 'views.py', 'lineno': lineno})
+
+    def test_01_repeated_records_summarized(self):
+        """Tests that only the first record of a kind is emailed and the others are counted in a summary."""
+        handler = AggregatingAdminEmailHandler(interval=600)
+        for i in range(50):
+            handler.handle(self._record('Unsuccessful token validation: token {}'.format(i)))
+        handler.handle(self._record('Other warning', lineno=120))
+        self.assertEqual([email.subject for email in mail.outbox],
+                         ['Képzés Mindenkinek! - WARNING: Unsuccessful token validation: token 0',
+                          'Képzés Mindenkinek! - WARNING: Other warning'])
+        handler.close()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('49 repeated log records in the last', mail.outbox[2].subject)
+        self.assertIn('49 occurrences', mail.outbox[2].body)
+        self.assertIn('Unsuccessful token validation: token 49', mail.outbox[2].body)
+
+    def test_02_summary_sent_at_end_of_interval(self):
+        """Tests that the summary is sent by a timer at the end of the interval and a new interval starts."""
+        handler = AggregatingAdminEmailHandler(interval=0.05)
+        for i in range(3):
+            handler.handle(self._record('warning {}'.format(i)))
+        handler._timer.join()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('2 occurrences', mail.outbox[1].body)
+        handler.handle(self._record('warning after the interval'))
+        self.assertEqual(len(mail.outbox), 3)
+        handler.close()
+        self.assertEqual(len(mail.outbox), 3)
+
+
 class HajniCoursesEmailTestCase(TestCase):
     """
     Test cases for the HajniCoursesEmail class.
@@ -103,3 +255,27 @@ class HajniCoursesEmailTestCase(TestCase):
             )
             self.assertTrue(client == client_2 == mock_instance)
             self.assertEqual(HajniCoursesEmail._msc, mock_instance)
+
+    def test_06_email_errors_raised_when_not_failing_silently(self):
+        """Tests that the sending errors are raised when fail_silently is False."""
+        with self.settings(TEST_MODE=False):
+            HajniCoursesEmail._msc = Mock()
+            HajniCoursesEmail._msc.emails.send = Mock(side_effect=MailerSendError("Test error"))
+            mail = HajniCoursesEmail(
+                to=["test@mail.com", "test2@mail.com"], subject="Test Subject", message="Test Message"
+            )
+            with self.assertRaises(MailerSendError):
+                mail.send(fail_silently=False)
+
+    def test_07_drain(self):
+        """Tests that drain waits for the emails submitted to the shared executor."""
+        with self.settings(TEST_MODE=False):
+            HajniCoursesEmail._msc = Mock()
+            HajniCoursesEmail._msc.emails.send = Mock(return_value="response")
+            mail = HajniCoursesEmail(
+                to="test@mail.com", subject="Test Subject", message="Test Message"
+            )
+            future = HajniCoursesEmail._get_executor().submit(mail.send)
+            HajniCoursesEmail.drain()
+            self.assertEqual(future.result(timeout=0), "response")
+            self.assertIsNone(HajniCoursesEmail._executor)
@@ -1,12 +1,17 @@
+import atexit
 import os
+import signal
+import sys
+import threading
 import yaml
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from django.conf import settings
 from django.db.models.query import QuerySet
 from mailersend import MailerSendClient, EmailBuilder
 from mailersend.exceptions import MailerSendError
 from mailersend.resources.email import EmailRequest, APIResponse
-from threading import RLock
+from threading import BoundedSemaphore, RLock
 
 from .logger import logger
 
@@ -28,6 +33,39 @@ def load_config():
     return config
 
 
+class BoundedExecutor:
+    """
+    Thread pool with a bounded queue. At most max_workers tasks run and queue_size tasks wait at the same time,
+    so a burst of work cannot create an unbounded number of threads or queued items.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, thread_name_prefix: str = ''):
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers,
+                                                                thread_name_prefix=thread_name_prefix)
+        self._slots: BoundedSemaphore = BoundedSemaphore(max_workers + queue_size)
+
+    def submit(self, fn, *args, block: bool = True, **kwargs) -> Future | None:
+        """
+        Schedules the callable. When the pool is full, it waits for a free slot if block is True,
+        otherwise it returns None without scheduling anything.
+        """
+        if not self._slots.acquire(blocking=block):
+            return None
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        """
+        Waits for the running and queued tasks to finish.
+        """
+        self._executor.shutdown(wait=True)
+
+
 class HajniCoursesEmail:
     """
     Represents an email to be sent via MailerSend.
@@ -35,10 +73,12 @@ class HajniCoursesEmail:
     """
     _msc: MailerSendClient = None
     _msc_lock: RLock = RLock()
+    _executor: BoundedExecutor = None
+    _executor_lock: RLock = RLock()
     email_config: dict = load_config().get('hajni_courses_email', {})
 
-    def __init__(self, to: str | QuerySet, subject: str, message: str):
-        self.to: str | QuerySet = to
+    def __init__(self, to: str | list | QuerySet, subject: str, message: str):
+        self.to: str | list | QuerySet = to
         self.subject: str = subject
         self.message: str = message
         email_builder = (
@@ -48,7 +88,7 @@ class HajniCoursesEmail:
             .subject(self.subject)
             .html(self.message)
         )
-        if type(to) is QuerySet:
+        if type(to) in (QuerySet, list):
             for recipient in to:
                 email_builder.to(str(recipient))
         else:
@@ -65,9 +105,49 @@ class HajniCoursesEmail:
                                                                        cls.email_config.get('mailersend_api_key')))
         return cls._msc
 
-    def send(self) -> APIResponse | None:
+    @classmethod
+    def _get_executor(cls) -> BoundedExecutor:
+        """Get or create the executor shared by the whole process to send the emails in the background."""
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = BoundedExecutor(max_workers=settings.EMAIL_EXECUTOR_MAX_WORKERS,
+                                                    queue_size=settings.EMAIL_EXECUTOR_QUEUE_SIZE,
+                                                    thread_name_prefix='hajni_courses_email')
+                    atexit.register(cls.drain)
+                    cls._install_sigterm_handler()
+        return cls._executor
+
+    @classmethod
+    def _install_sigterm_handler(cls):
+        """
+        Drains the pending emails on SIGTERM, unless the process (e.g. gunicorn or a management command) already
+        handles the signal itself; then they are drained at exit.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+            return
+
+        def handle_sigterm(signum, frame):
+            cls.drain()
+            sys.exit(128 + signum)
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    @classmethod
+    def drain(cls):
+        """
+        Waits until the emails submitted to the executor are sent.
+        """
+        with cls._executor_lock:
+            executor, cls._executor = cls._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def send(self, fail_silently: bool = True) -> APIResponse | None:
         """
-        Send the email.
+        Send the email. Errors are logged and swallowed unless fail_silently is False, in which case they are raised
+        to the caller (e.g. to let the email outbox retry the sending).
         """
         try:
             if settings.TEST_MODE:
@@ -75,12 +155,16 @@ class HajniCoursesEmail:
             response = self._get_client().emails.send(self.email)
             return response
         except MailerSendError as se:
+            if not fail_silently:
+                raise
             logger.error(
                 f"Failed to send email to {self.to} with subject {self.subject} due to MailerSendError: {str(se)}",
                 exc_info=True,
             )
             return None
         except Exception as e:
+            if not fail_silently:
+                raise
             logger.error(
                 f"Failed to send email to {self.to} with subject {self.subject}: {str(e)}",
                 exc_info=True,
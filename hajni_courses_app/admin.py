@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from .models import CustomUser, Course
+from .models import CustomUser, Course, EmailOutbox, DownloadableFile
 
 
 admin.site.register(CustomUser)
 admin.site.register(Course)
+admin.site.register(EmailOutbox)
+admin.site.register(DownloadableFile)
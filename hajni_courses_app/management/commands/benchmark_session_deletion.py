@@ -0,0 +1,67 @@
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from hajni_courses_app.models import CustomUser, UserSession
+from hajni_courses_app.session_backend import SessionStore
+
+
+class Rollback(Exception):
+    """Raised to roll back the benchmark data."""
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of logging out a user from all their sessions with a large session table.
+    The generated users and sessions are rolled back at the end.
+    """
+    help = 'Benchmarks deleting the sessions of a user when the session table is large.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=1_000_000, help='Number of sessions to generate.')
+        parser.add_argument('--users', type=int, default=1_000, help='Number of users owning the sessions.')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows inserted in one query.')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Also time the former approach of decoding every session in Python.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, options):
+        start = time.perf_counter()
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username='benchmark_user_{}'.format(i), password='!') for i in range(options['users'])])
+        session_data = {user.pk: SessionStore().encode({SESSION_KEY: str(user.pk)}) for user in users}
+        expire_date = timezone.now() + timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        for batch_start in range(0, options['sessions'], options['batch_size']):
+            batch_end = min(batch_start + options['batch_size'], options['sessions'])
+            UserSession.objects.bulk_create([
+                UserSession(session_key=uuid.uuid4().hex, session_data=session_data[users[i % len(users)].pk],
+                            expire_date=expire_date, user_id=users[i % len(users)].pk)
+                for i in range(batch_start, batch_end)])
+        self.stdout.write('Generated {} sessions for {} users in {:.2f} s'.format(
+            options['sessions'], options['users'], time.perf_counter() - start))
+
+        if options['legacy']:
+            user = users[1 % len(users)]
+            start = time.perf_counter()
+            session_keys = [s.session_key for s in UserSession.objects.all()
+                            if s.get_decoded().get(SESSION_KEY) == str(user.pk)]
+            deleted, _deleted_per_model = UserSession.objects.filter(session_key__in=session_keys).delete()
+            self.stdout.write('Legacy full scan: deleted {} sessions in {:.3f} s'.format(
+                deleted, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        deleted = users[0].logout_everywhere()
+        self.stdout.write('Indexed delete: deleted {} sessions in {:.3f} s'.format(
+            deleted, time.perf_counter() - start))
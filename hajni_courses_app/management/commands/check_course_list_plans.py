@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from hajni_courses_app.models import Course
+from hajni_courses_app.utils.course_listing import CourseListing
+from hajni_courses_app.views import PensionerCoursesListPage, GeneralCoursesListPage
+
+
+class Rollback(Exception):
+    """Raised to roll back the seeded courses."""
+
+
+def is_index_scan(plan: str, vendor: str) -> bool:
+    """
+    Returns whether the query plan reads the courses through an index, without a sequential scan or a sort.
+    """
+    if vendor == 'postgresql':
+        return 'Index' in plan and 'Seq Scan' not in plan and 'Sort' not in plan
+    return ('USING INDEX' in plan or 'USING COVERING INDEX' in plan) and 'TEMP B-TREE' not in plan
+
+
+class Command(BaseCommand):
+    """
+    Query plan regression check of the course list pages. The seeded courses are rolled back at the end.
+    """
+    help = 'Seeds a large course table and checks via EXPLAIN that the course list queries use an index scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100_000, help='Number of courses to seed.')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows inserted in one query.')
+
+    def handle(self, *args, **options):
+        failures = []
+        try:
+            with transaction.atomic():
+                self._seed(options['courses'], options['batch_size'])
+                failures = self._check_plans()
+                raise Rollback
+        except Rollback:
+            pass
+        if failures:
+            raise CommandError('The following course list queries do not use an index scan: {}'.format(
+                ', '.join(failures)))
+        self.stdout.write('All course list queries use an index scan.')
+
+    def _seed(self, courses: int, batch_size: int):
+        """
+        Seeds the courses, most of them inactive like the courses of past years.
+        """
+        for batch_start in range(0, courses, batch_size):
+            Course.objects.bulk_create([
+                Course(name='plan_check_course_{}'.format(i), price=10000, description='*one*two*three',
+                       duration='3 times 90 minutes', extra_info='', active=i % 10 == 0,
+                       for_pensioners=i % 2 == 0, for_non_pensioners=i % 3 != 0,
+                       slug='plan-check-course-{}'.format(i))
+                for i in range(batch_start, min(batch_start + batch_size, courses))])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(Course._meta.db_table)))
+
+    def _check_plans(self) -> list[str]:
+        index_names = [index.name for index in Course._meta.indexes]
+        failures = []
+        for view_class in (PensionerCoursesListPage, GeneralCoursesListPage):
+            listing = CourseListing(view_class.audience, view_class.course_filter)
+            courses = listing.get_courses()
+            count = courses.count()
+            if not count:
+                raise CommandError('No {} course is listed to check the queries of, seed more courses with '
+                                   '--courses.'.format(view_class.audience))
+            middle_id = courses.values_list('id', flat=True)[count // 2]
+            queries = {
+                'first page': courses[:listing.per_page],
+                'page by id': courses.filter(id__gte=middle_id)[:listing.per_page],
+            }
+            for query_name, query in queries.items():
+                plan = query.explain()
+                self.stdout.write('{} {}:\n{}'.format(view_class.audience, query_name, plan))
+                if not is_index_scan(plan, connection.vendor) or not any(name in plan for name in index_names):
+                    failures.append('{} {}'.format(view_class.audience, query_name))
+        return failures
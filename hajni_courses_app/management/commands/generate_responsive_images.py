@@ -0,0 +1,54 @@
+import json
+import os
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps, features
+
+from hajni_courses_app.utils.constants import RESPONSIVE_IMAGES, RESPONSIVE_IMAGE_WIDTHS, RESPONSIVE_IMAGE_QUALITY, \
+    RESPONSIVE_IMAGE_DIRECTORY
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'static')
+
+
+class Command(BaseCommand):
+    """
+    Generates the smaller AVIF and WebP versions of the large images of the static files and the manifest of them
+    read by the responsive_image template tag. Run it after an image is changed, before collectstatic.
+    """
+    help = 'Generates resized AVIF and WebP versions of the images of the static files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--static-dir', default=STATIC_DIR, help='Static files directory of the images.')
+
+    def handle(self, *args, **options):
+        static_dir = options['static_dir']
+        output_dir = os.path.join(static_dir, RESPONSIVE_IMAGE_DIRECTORY)
+        os.makedirs(output_dir, exist_ok=True)
+        formats = [image_format for image_format in RESPONSIVE_IMAGE_QUALITY if features.check(image_format)]
+        manifest = {}
+        for name in RESPONSIVE_IMAGES:
+            with Image.open(os.path.join(static_dir, name)) as original:
+                image = ImageOps.exif_transpose(original)
+                image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+            widths = [width for width in RESPONSIVE_IMAGE_WIDTHS if width < image.width]
+            if len(widths) < len(RESPONSIVE_IMAGE_WIDTHS):
+                # the image is not enlarged, its own width is the largest one
+                widths.append(image.width)
+            variants = {image_format: [] for image_format in formats}
+            original_size = os.path.getsize(os.path.join(static_dir, name))
+            smallest_size = original_size
+            for width in widths:
+                resized = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+                for image_format in formats:
+                    variant_name = '{}/{}-{}.{}'.format(RESPONSIVE_IMAGE_DIRECTORY, os.path.splitext(name)[0], width,
+                                                        image_format)
+                    resized.save(os.path.join(static_dir, variant_name), image_format.upper(),
+                                 quality=RESPONSIVE_IMAGE_QUALITY[image_format])
+                    variants[image_format].append([width, variant_name])
+                    smallest_size = min(smallest_size, os.path.getsize(os.path.join(static_dir, variant_name)))
+            manifest[name] = {'width': image.width, 'height': image.height, 'variants': variants}
+            self.stdout.write('{}: {} widths in {}, the smallest is {} KB instead of {} KB.'.format(
+                name, len(widths), ', '.join(formats), round(smallest_size / 1024), round(original_size / 1024)))
+        with open(os.path.join(output_dir, 'manifest.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+            manifest_file.write('\n')
@@ -0,0 +1,46 @@
+import os
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from hajni_courses_app.models import DownloadableFile
+from hajni_courses_app.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    """
+    Imports the files of a directory into the downloads, with a group for every folder of the directory
+    (e.g. `media/files/<group>/<file>`). The content of the files is stored only once, the unchanged files are
+    skipped.
+    """
+    help = 'Imports the files of a directory into the downloads, one group per folder.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?', default=os.path.join(settings.MEDIA_ROOT, 'files'),
+                            help='Directory with a folder for every group.')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError('{} is not a directory.'.format(directory))
+        imported = unchanged = 0
+        for folder_name in sorted(os.listdir(directory)):
+            folder_path = os.path.join(directory, folder_name)
+            if not os.path.isdir(folder_path):
+                continue
+            group = folder_name.replace('_', ' ').title()
+            for file_name in sorted(os.listdir(folder_path)):
+                file_path = os.path.join(folder_path, file_name)
+                if not os.path.isfile(file_path):
+                    continue
+                downloadable_file = DownloadableFile.objects.filter(group=group, name=file_name).first() \
+                    or DownloadableFile(group=group, name=file_name)
+                with open(file_path, 'rb') as file:
+                    content = File(file)
+                    if downloadable_file.pk and \
+                            downloadable_file.sha256 == ContentAddressedStorage.hash_content(content):
+                        unchanged += 1
+                        continue
+                    downloadable_file.blob.save(file_name, content)
+                imported += 1
+        self.stdout.write('Imported {} files, {} files were unchanged.'.format(imported, unchanged))
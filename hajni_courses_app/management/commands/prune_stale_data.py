@@ -0,0 +1,54 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hajni_courses.logger import logger
+from hajni_courses_app.models import CustomUser, EmailOutbox, UserSession
+from hajni_courses_app.utils.constants import PRUNE_BATCH_SIZE, PRUNE_BATCH_PAUSE, SENT_EMAIL_MAX_AGE, \
+    UNACTIVATED_ACCOUNT_MAX_AGE
+
+
+class Command(BaseCommand):
+    """
+    Deletes the expired sessions, the accounts never activated and the old sent emails in small batches, each in its
+    own short transaction, so it can run against the live database (e.g. daily from cron).
+    """
+    help = 'Deletes the expired sessions, the accounts never activated and the old sent emails in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE,
+                            help='Rows deleted in one transaction.')
+        parser.add_argument('--pause', type=float, default=PRUNE_BATCH_PAUSE,
+                            help='Seconds to wait between two batches.')
+        parser.add_argument('--account-age', type=int, default=UNACTIVATED_ACCOUNT_MAX_AGE,
+                            help='Days after which an account never activated is deleted.')
+        parser.add_argument('--sent-email-age', type=int, default=SENT_EMAIL_MAX_AGE,
+                            help='Days after which a sent email is deleted from the email outbox.')
+
+    def handle(self, *args, **options):
+        joined_before = timezone.now() - timedelta(days=options['account_age'])
+        sessions = self._prune('expired sessions', lambda: UserSession.delete_expired(options['batch_size']),
+                               options['pause'])
+        accounts = self._prune('accounts never activated',
+                               lambda: CustomUser.delete_unactivated(joined_before, options['batch_size']),
+                               options['pause'])
+        sent_before = timezone.now() - timedelta(days=options['sent_email_age'])
+        emails = self._prune('sent emails', lambda: EmailOutbox.delete_sent(sent_before, options['batch_size']),
+                             options['pause'])
+        logger.info('Pruned {} expired sessions, {} accounts never activated and {} sent emails'.format(
+            sessions, accounts, emails))
+
+    def _prune(self, name: str, delete_batch, pause: float) -> int:
+        """
+        Deletes batches until there is nothing left to delete, reporting the progress after every batch.
+        """
+        total = 0
+        start = time.monotonic()
+        while deleted := delete_batch():
+            total += deleted
+            self.stdout.write('Deleted {} {} ({} in total, {:.1f} s)'.format(
+                deleted, name, total, time.monotonic() - start))
+            time.sleep(pause)
+        self.stdout.write('Deleted {} {}.'.format(total, name))
+        return total
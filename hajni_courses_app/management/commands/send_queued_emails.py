@@ -0,0 +1,50 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+
+from hajni_courses.logger import logger
+from hajni_courses_app.models import EmailOutbox
+from hajni_courses_app.utils.constants import EMAIL_OUTBOX_BATCH_SIZE, EMAIL_OUTBOX_POLL_INTERVAL, \
+    EMAIL_ADMIN_DIGEST_WINDOW
+
+
+class Command(BaseCommand):
+    """
+    Worker sending the emails queued in the email outbox. Several workers can run at the same time.
+    """
+    help = 'Sends the emails queued in the email outbox.'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stopping = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EMAIL_OUTBOX_BATCH_SIZE,
+                            help='Number of emails claimed in one transaction.')
+        parser.add_argument('--poll-interval', type=float, default=EMAIL_OUTBOX_POLL_INTERVAL,
+                            help='Seconds to wait when there is no email to send.')
+        parser.add_argument('--digest-window', type=int, default=EMAIL_ADMIN_DIGEST_WINDOW,
+                            help='Seconds the admin notifications are collected for before sending them together.')
+        parser.add_argument('--once', action='store_true',
+                            help='Send the emails that are due and exit instead of polling forever.')
+
+    def _stop(self, signum, frame):
+        """Lets the current batch finish before exiting."""
+        self._stopping = True
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        logger.info('Email outbox worker started')
+        sent = 0
+        while not self._stopping:
+            claimed = EmailOutbox.send_pending(batch_size=options['batch_size'])
+            claimed += EmailOutbox.send_admin_digest(window=options['digest_window'])
+            sent += claimed
+            if claimed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+        logger.info('Email outbox worker stopped after processing {} emails'.format(sent))
+        self.stdout.write('Processed {} emails.'.format(sent))
@@ -0,0 +1,180 @@
+import cProfile
+import mimetypes
+import os
+import random
+import threading
+import time
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.db import connection
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from hajni_courses.logger import logger
+from hajni_courses_app.utils import metrics
+from hajni_courses_app.utils.profiling import save_profile
+from hajni_courses_app.utils.sql_inspection import QueryInspector
+from hajni_courses_app.utils.constants import STATIC_FILES_CACHE_MAX_AGE, STATIC_FILES_UNHASHED_CACHE_MAX_AGE
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the files collected into STATIC_ROOT when no front-end server does it. The precompressed Brotli or gzip
+    version of a file is sent if the browser accepts it, and the content hashed files can be cached forever.
+    """
+    # Content-Encoding of the precompressed versions, in the order of preference
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and settings.STATIC_ROOT and request.path.startswith(settings.STATIC_URL):
+            response = self.serve(request, request.path.removeprefix(settings.STATIC_URL))
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    @staticmethod
+    def get_accepted_encodings(accept_encoding: str) -> set[str]:
+        """Returns the encodings of an Accept-Encoding header, except the ones refused with q=0."""
+        encodings = set()
+        for item in accept_encoding.split(','):
+            encoding, _semicolon, parameters = item.partition(';')
+            if parameters.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                encodings.add(encoding.strip().lower())
+        return encodings
+
+    def serve(self, request, name: str) -> FileResponse | None:
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        accepted_encodings = self.get_accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        content_encoding = None
+        for encoding, extension in self.ENCODINGS:
+            if encoding in accepted_encodings and os.path.isfile(path + extension):
+                content_encoding = encoding
+                path += extension
+                break
+        response = FileResponse(open(path, 'rb'),
+                                content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if name in self.hashed_names:
+            patch_cache_control(response, public=True, max_age=STATIC_FILES_CACHE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=STATIC_FILES_UNHASHED_CACHE_MAX_AGE)
+        return response
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the SQL queries and the time spent in them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, the SQL queries and the response size of the requests per URL name into the metrics file
+    of the process, the /metrics endpoint sums the files of all the processes. It is not used without METRICS_DIR.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(query_counter):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        if response.streaming:
+            response_size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            response_size = len(response.content)
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        try:
+            metrics.record_request(view, response.status_code, duration, query_counter.count, query_counter.duration,
+                                   response_size)
+        except OSError:
+            logger.exception('Could not record the metrics of the request.')
+        return response
+
+
+class SlowRequestProfilerMiddleware:
+    """
+    Profiles a PROFILING_SAMPLE_RATE fraction of the requests with cProfile, and saves the report of the ones slower
+    than PROFILING_THRESHOLD seconds into PROFILING_DIR, keeping the last PROFILING_MAX_FILES reports.
+    It is not used while PROFILING_SAMPLE_RATE is 0.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # one request of the process is profiled at a time
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if random.random() >= settings.PROFILING_SAMPLE_RATE or not self.lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler (e.g. of a debugger) is active
+                return self.get_response(request)
+            start = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                duration = time.perf_counter() - start
+                profiler.disable()
+        finally:
+            self.lock.release()
+        if duration >= settings.PROFILING_THRESHOLD:
+            try:
+                save_profile(profiler, request, response, duration)
+            except OSError:
+                logger.exception('Could not save the profile of the slow request.')
+        return response
+
+
+class QueryInspectorMiddleware:
+    """
+    Logs the slow SQL queries of the requests, and reports the queries repeated within a request (N+1 queries).
+    It is not used while SQL_INSPECTION_ENABLED is off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSPECTION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_inspector = QueryInspector()
+        with connection.execute_wrapper(query_inspector):
+            response = self.get_response(request)
+        query_inspector.report(request)
+        return response
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipients', models.JSONField()),
+                ('subject', models.CharField(max_length=250)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Függőben'), ('sent', 'Elküldve'), ('failed', 'Sikertelen')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='emailoutbox_due_idx')],
+            },
+        ),
+    ]
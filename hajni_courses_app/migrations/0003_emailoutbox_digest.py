@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0002_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='digest',
+            field=models.BooleanField(default=False),
+        ),
+    ]
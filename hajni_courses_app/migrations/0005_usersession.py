@@ -0,0 +1,52 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_sessions(apps, schema_editor):
+    """Copies the unexpired sessions of the default session backend, so the users stay logged in."""
+    from django.contrib.sessions.backends.base import SessionBase
+    from django.utils import timezone
+    Session = apps.get_model('sessions', 'Session')
+    UserSession = apps.get_model('hajni_courses_app', 'UserSession')
+    decoder = SessionBase()
+    batch = []
+    for session in Session.objects.filter(expire_date__gt=timezone.now()).iterator(chunk_size=2000):
+        try:
+            user_id = int(decoder.decode(session.session_data).get('_auth_user_id'))
+        except (TypeError, ValueError):
+            user_id = None
+        batch.append(UserSession(session_key=session.session_key, session_data=session.session_data,
+                                 expire_date=session.expire_date, user_id=user_id))
+        if len(batch) == 2000:
+            UserSession.objects.bulk_create(batch)
+            batch = []
+    UserSession.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0004_customuser_superuser_idx'),
+        ('sessions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSession',
+            fields=[
+                ('session_key', models.CharField(max_length=40, primary_key=True, serialize=False, verbose_name='session key')),
+                ('session_data', models.TextField(verbose_name='session data')),
+                ('expire_date', models.DateTimeField(db_index=True, verbose_name='expire date')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'session',
+                'verbose_name_plural': 'sessions',
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(copy_sessions, migrations.RunPython.noop),
+    ]
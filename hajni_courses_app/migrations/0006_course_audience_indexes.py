@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0005_usersession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(condition=models.Q(('active', True), ('for_pensioners', True)), fields=['id'], name='course_pensioners_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(condition=models.Q(('active', True), ('for_non_pensioners', True)), fields=['id'], name='course_non_pensioners_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:16
+
+from django.db import migrations, models
+
+
+def populate_card_data(apps, schema_editor):
+    """Populates the card data of the existing courses, the same way as Course.populate_card_data."""
+    Course = apps.get_model('hajni_courses_app', 'Course')
+    for course in Course.objects.all():
+        course.short_name = course.name.split('(')[0].upper()
+        course.description_items = course.description.split('*')
+        course.price_display = f"{course.price:,.0f}".replace(',', '.')
+        course.save(update_fields=['short_name', 'description_items', 'price_display'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0007_course_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='description_items',
+            field=models.JSONField(default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='price_display',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='short_name',
+            field=models.CharField(default='', editable=False, max_length=250),
+        ),
+        migrations.RunPython(populate_card_data, migrations.RunPython.noop),
+    ]
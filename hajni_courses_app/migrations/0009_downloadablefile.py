@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:26
+
+import hajni_courses_app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hajni_courses_app', '0008_course_card_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadableFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=150)),
+                ('name', models.CharField(blank=True, max_length=250)),
+                ('blob', models.FileField(storage=hajni_courses_app.storage.ContentAddressedStorage(), upload_to='')),
+                ('size', models.PositiveBigIntegerField(default=0, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['group', 'name'],
+                'constraints': [models.UniqueConstraint(fields=('group', 'name'), name='downloadablefile_unique_name')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('hajni_courses_app', '0009_downloadablefile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_active', False), ('last_login__isnull', True)), fields=['date_joined'], name='customuser_unactivated_idx'),
+        ),
+    ]
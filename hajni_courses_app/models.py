@@ -1,11 +1,15 @@
-import threading
-from django.db import models
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
 from django.db.utils import Error
 from django.contrib.auth import logout
 from django.contrib.auth.models import AbstractUser
-from django.contrib.sessions.models import Session
+from django.contrib.sessions.base_session import AbstractBaseSession
+from django.core.cache import cache, caches
 from django.core.validators import RegexValidator
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
@@ -14,7 +18,11 @@ from django.utils.translation import gettext_lazy as _
 from hajni_courses.logger import logger
 from hajni_courses.utils import HajniCoursesEmail
 from hajni_courses_app.utils.constants import PHONE_NUMBER_VALIDATOR, USER_CANCELLATION_EMAIL_SUBJECT, \
-    USER_REGISTRATION_EMAIL_SUBJECT, CALLBACK_EMAIL_SUBJECT, APPLICATION_EMAIL_SUBJECT, APPLICATION_CONFIRMATION_SUBJECT
+    USER_REGISTRATION_EMAIL_SUBJECT, CALLBACK_EMAIL_SUBJECT, APPLICATION_EMAIL_SUBJECT, APPLICATION_CONFIRMATION_SUBJECT, \
+    ADMIN_DIGEST_EMAIL_SUBJECT, EMAIL_OUTBOX_BATCH_SIZE, EMAIL_OUTBOX_CLAIM_TIMEOUT, EMAIL_OUTBOX_MAX_ATTEMPTS, \
+    EMAIL_OUTBOX_RETRY_BASE_DELAY, EMAIL_OUTBOX_RETRY_MAX_DELAY, EMAIL_ADMIN_DIGEST_WINDOW, EMAIL_ADMIN_DIGEST_MAX_SIZE, \
+    ADMIN_EMAILS_CACHE_KEY, ADMIN_EMAILS_CACHE_TIMEOUT, DOWNLOADS_BLOB_DIRECTORY
+from hajni_courses_app.storage import ContentAddressedStorage
 from hajni_courses_app.utils.AccountActivationTokenGenerator import account_activation_token
 
 
@@ -26,23 +34,39 @@ class CustomUser(AbstractUser):
     phone_number = models.CharField(max_length=20, validators=[RegexValidator(regex=PHONE_NUMBER_VALIDATOR,
                                                                               message=_('Adjon meg egy érvényes telefonszámot!'))])
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # partial index covering the superuser email lookup of get_admin_emails
+            models.Index(fields=['email'], condition=models.Q(is_superuser=True), name='customuser_superuser_idx'),
+            # partial index of the accounts never activated, read by delete_unactivated
+            models.Index(fields=['date_joined'], condition=models.Q(is_active=False, last_login__isnull=True),
+                         name='customuser_unactivated_idx'),
+        ]
+
+    @staticmethod
+    def get_admin_emails() -> list[str]:
+        """
+        Returns the email addresses of the superusers. The list is cached until a user is saved or deleted.
+        """
+        admin_emails = cache.get(ADMIN_EMAILS_CACHE_KEY)
+        if admin_emails is None:
+            admin_emails = list(CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True))
+            cache.set(ADMIN_EMAILS_CACHE_KEY, admin_emails, ADMIN_EMAILS_CACHE_TIMEOUT)
+        return admin_emails
+
     @staticmethod
     def send_callback_request(self):
-        superusers_emails = CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True)
+        superusers_emails = CustomUser.get_admin_emails()
         html_message = render_to_string('emails/callback_request.html', {'user': self})
-        email = HajniCoursesEmail(to=superusers_emails, subject=str(_(CALLBACK_EMAIL_SUBJECT)),
-                                  message=html_message)
-        threading.Thread(target=email.send).start()
+        EmailOutbox.enqueue(to=superusers_emails, subject=str(_(CALLBACK_EMAIL_SUBJECT)), message=html_message,
+                            digest=True)
 
     @staticmethod
     def delete_user_profile(request) -> bool:
         try:
             user = request.user
             # log out the user from all sessions
-            all_sessions = Session.objects.filter(session_key__in=[s.session_key for s in Session.objects.all() if
-                                                                   s.get_decoded().get('_auth_user_id') == str(user.id)])
-            for session in all_sessions:
-                session.delete()
+            user.logout_everywhere()
             # log out the current session
             logout(request)
             # delete the user
@@ -51,6 +75,34 @@ class CustomUser(AbstractUser):
         except:
             return False
 
+    @classmethod
+    def delete_unactivated(cls, joined_before, batch_size: int) -> int:
+        """
+        Deletes a batch of the accounts that signed up before the given time and were never activated, with their
+        sessions. The cancelled accounts were activated and logged in, so they are kept. Returns the number of
+        deleted accounts.
+        """
+        with transaction.atomic():
+            user_ids = list(cls.objects.filter(is_active=False, last_login__isnull=True, date_joined__lt=joined_before,
+                                               is_staff=False, is_superuser=False)
+                            .order_by('date_joined').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                return 0
+            _deleted, deleted_per_model = cls.objects.filter(pk__in=user_ids).delete()
+        return deleted_per_model.get(cls._meta.label, 0)
+
+    def logout_everywhere(self) -> int:
+        """
+        Logs out the user from all their sessions, deleting them from the cache too. Returns the number of deleted
+        sessions.
+        """
+        sessions = UserSession.objects.filter(user_id=self.pk)
+        cache_key_prefix = UserSession.get_session_store_class().cache_key_prefix
+        cache_keys = [cache_key_prefix + session_key for session_key in sessions.values_list('session_key', flat=True)]
+        deleted, _deleted_per_model = sessions.delete()
+        caches[settings.SESSION_CACHE_ALIAS].delete_many(cache_keys)
+        return deleted
+
     def send_activation_link(self, domain: str, protocol: str):
         """
         Sends the activation link to the user's email.
@@ -61,27 +113,53 @@ class CustomUser(AbstractUser):
                          'token': account_activation_token.make_token(self),
                          'protocol': protocol}
         html_message = render_to_string('emails/user_registration.html', email_context)
-        email = HajniCoursesEmail(to=self.email, subject=str(_(USER_REGISTRATION_EMAIL_SUBJECT)),
-                                  message=html_message)
-        threading.Thread(target=email.send).start()
+        EmailOutbox.enqueue(to=self.email, subject=str(_(USER_REGISTRATION_EMAIL_SUBJECT)), message=html_message)
 
     def cancel_user(self) -> bool:
         """
         Cancels the user by putting the is_active flag to False. The user is notified via email.
         """
         try:
-            self.is_active = False
-            self.save()
             html_message = render_to_string('emails/user_cancellation.html', {'username': self.username})
-            email = HajniCoursesEmail(to=self.email, subject=str(_(USER_CANCELLATION_EMAIL_SUBJECT)),
-                                      message=html_message)
-            threading.Thread(target=email.send).start()
+            with transaction.atomic():
+                self.is_active = False
+                self.save()
+                EmailOutbox.enqueue(to=self.email, subject=str(_(USER_CANCELLATION_EMAIL_SUBJECT)),
+                                    message=html_message)
             return True
         except Error:
             logger.error('An error happened during the cancellation of the user {}'.format(self.pk, self.username))
             return False
 
 
+class UserSession(AbstractBaseSession):
+    """
+    Session model storing the id of the logged-in user in an indexed column, so that all the sessions of a user
+    can be found and deleted without decoding every session.
+    """
+    user = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.CASCADE, db_constraint=False,
+                             related_name='sessions')
+
+    @classmethod
+    def get_session_store_class(cls):
+        from hajni_courses_app.session_backend import SessionStore
+        return SessionStore
+
+    @classmethod
+    def delete_expired(cls, batch_size: int) -> int:
+        """
+        Deletes a batch of the expired sessions, reading them through the index of the expiry date. Returns the
+        number of deleted sessions.
+        """
+        now = timezone.now()
+        session_keys = list(cls.objects.filter(expire_date__lt=now).order_by('expire_date')
+                            .values_list('session_key', flat=True)[:batch_size])
+        if not session_keys:
+            return 0
+        deleted, _deleted_per_model = cls.objects.filter(session_key__in=session_keys, expire_date__lt=now).delete()
+        return deleted
+
+
 class Course(models.Model):
     """
     Course model.
@@ -96,37 +174,269 @@ class Course(models.Model):
     for_non_pensioners = models.BooleanField(default=True)
     active = models.BooleanField(default=True)
     slug = models.SlugField(unique=True, max_length=255, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # card data derived from the fields above when saving, so that it is not computed on every render
+    short_name = models.CharField(max_length=250, default='', editable=False)
+    description_items = models.JSONField(default=list, editable=False)
+    price_display = models.CharField(max_length=20, default='', editable=False)
+
+    # the fields rendered by the course list pages
+    CARD_FIELDS = ('id', 'slug', 'short_name', 'duration', 'description_items')
+
+    class Meta:
+        indexes = [
+            # partial indexes matching the filters and the ordering of the course list pages
+            models.Index(fields=['id'], condition=models.Q(active=True, for_pensioners=True),
+                         name='course_pensioners_idx'),
+            models.Index(fields=['id'], condition=models.Q(active=True, for_non_pensioners=True),
+                         name='course_non_pensioners_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """
-        Overriding the save method to populate the slug.
+        Overriding the save method to populate the slug and the card data.
         """
         if not self.slug:
             self.slug = slugify(self.name)
+        self.populate_card_data()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'short_name', 'description_items',
+                                                                      'price_display'}
         super().save(*args, **kwargs)
 
+    def populate_card_data(self):
+        """
+        Populates the name without the part in parentheses in uppercase, the items of the star separated
+        description and the price with thousands separators.
+        """
+        self.short_name = self.name.split('(')[0].upper()
+        self.description_items = self.description.split('*')
+        self.price_display = f"{self.price:,.0f}".replace(',', '.')
+
     @staticmethod
     def send_application(application_data):
         # email to the admin
-        superusers_emails = CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True)
-        html_message = render_to_string('emails/application.html', {'first_name': application_data['first_name'],
-                                                                    'last_name': application_data['last_name'],
-                                                                    'age': application_data['age'],
-                                                                    'address': application_data['address'],
-                                                                    'email': application_data['email'],
-                                                                    'phone_number': application_data['phone_number'],
-                                                                    'experience': application_data['experience'],
-                                                                    'course': application_data['course']
-                                                                    })
-        email = HajniCoursesEmail(to=superusers_emails, subject=str(_(APPLICATION_EMAIL_SUBJECT)),
-                                  message=html_message)
-        threading.Thread(target=email.send).start()
-
+        superusers_emails = CustomUser.get_admin_emails()
+        admin_html_message = render_to_string('emails/application.html',
+                                              {'first_name': application_data['first_name'],
+                                               'last_name': application_data['last_name'],
+                                               'age': application_data['age'],
+                                               'address': application_data['address'],
+                                               'email': application_data['email'],
+                                               'phone_number': application_data['phone_number'],
+                                               'experience': application_data['experience'],
+                                               'course': application_data['course']
+                                               })
         # email to the user
-        html_message = render_to_string('emails/application_confirmation.html',
-                                        {'first_name': application_data['first_name'],
-                                         'course': application_data['course']
-                                         })
-        email = HajniCoursesEmail(to=application_data['email'], subject=str(_(APPLICATION_CONFIRMATION_SUBJECT)),
-                                  message=html_message)
-        threading.Thread(target=email.send).start()
+        user_html_message = render_to_string('emails/application_confirmation.html',
+                                             {'first_name': application_data['first_name'],
+                                              'course': application_data['course']
+                                              })
+        with transaction.atomic():
+            EmailOutbox.enqueue(to=superusers_emails, subject=str(_(APPLICATION_EMAIL_SUBJECT)),
+                                message=admin_html_message, digest=True)
+            EmailOutbox.enqueue(to=application_data['email'], subject=str(_(APPLICATION_CONFIRMATION_SUBJECT)),
+                                message=user_html_message)
+
+
+class EmailOutbox(models.Model):
+    """
+    Email waiting to be sent by the send_queued_emails management command.
+    The row is written in the same transaction as the change it notifies about, so the email is not lost when a
+    web worker is restarted, and the request never waits for MailerSend.
+    Admin notifications are marked as digest and sent together in one email per recipient list.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Függőben')
+        SENT = 'sent', _('Elküldve')
+        FAILED = 'failed', _('Sikertelen')
+
+    recipients = models.JSONField()
+    subject = models.CharField(max_length=250)
+    message = models.TextField()
+    digest = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='emailoutbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{} - {} ({})'.format(', '.join(self.recipients), self.subject, self.status)
+
+    @classmethod
+    def enqueue(cls, to, subject: str, message: str, digest: bool = False) -> 'EmailOutbox | None':
+        """
+        Queues an email for the given recipient or recipients (e.g. a values_list QuerySet of email addresses).
+        Digest emails are collected and sent together by send_admin_digest.
+        An email without recipients (e.g. an admin notification while there is no superuser) is not queued.
+        """
+        recipients = [to] if isinstance(to, str) else [str(recipient) for recipient in to]
+        if not recipients:
+            return None
+        return cls.objects.create(recipients=recipients, subject=subject, message=message, digest=digest)
+
+    @classmethod
+    def send_pending(cls, batch_size: int = EMAIL_OUTBOX_BATCH_SIZE) -> int:
+        """
+        Claims a batch of due emails with SELECT ... FOR UPDATE SKIP LOCKED and sends them in parallel through the
+        shared email executor. Rows claimed by another worker are skipped, so several workers can run side by side.
+        The claim only postpones the emails by EMAIL_OUTBOX_CLAIM_TIMEOUT and is committed before sending, so no
+        transaction is kept open while waiting for MailerSend, and the emails of a crashed worker are sent later.
+        Returns the number of claimed emails.
+        """
+        with transaction.atomic():
+            batch = list(cls.objects.select_for_update(skip_locked=True)
+                         .filter(status=cls.Status.PENDING, digest=False, next_attempt_at__lte=timezone.now())
+                         .order_by('next_attempt_at', 'id')[:batch_size])
+            cls.objects.filter(pk__in=[outbox_email.pk for outbox_email in batch]) \
+                .update(next_attempt_at=timezone.now() + timedelta(seconds=EMAIL_OUTBOX_CLAIM_TIMEOUT))
+        executor = HajniCoursesEmail._get_executor()
+        sendings = [(outbox_email, executor.submit(outbox_email._send_email)) for outbox_email in batch]
+        errors = [(outbox_email, future.exception()) for outbox_email, future in sendings]
+        with transaction.atomic():
+            for outbox_email, error in errors:
+                outbox_email._save_result(error)
+        return len(batch)
+
+    @classmethod
+    def send_admin_digest(cls, window: int = EMAIL_ADMIN_DIGEST_WINDOW) -> int:
+        """
+        Sends the due digest emails as one email per recipient list, once the oldest of them has been waiting for
+        `window` seconds. Until then, the new notifications are collected. Like send_pending, the notifications are
+        claimed in a transaction committed before sending. Returns the number of notifications sent.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            notifications = list(cls.objects.select_for_update(skip_locked=True)
+                                 .filter(status=cls.Status.PENDING, digest=True, next_attempt_at__lte=now)
+                                 .order_by('id')[:EMAIL_ADMIN_DIGEST_MAX_SIZE])
+            if not notifications or min(n.created_at for n in notifications) > now - timedelta(seconds=window):
+                return 0
+            cls.objects.filter(pk__in=[notification.pk for notification in notifications]) \
+                .update(next_attempt_at=now + timedelta(seconds=EMAIL_OUTBOX_CLAIM_TIMEOUT))
+        digests = {}
+        for notification in notifications:
+            digests.setdefault(tuple(sorted(notification.recipients)), []).append(notification)
+        errors = []
+        for recipients, group in digests.items():
+            if len(group) == 1:
+                subject, message = group[0].subject, group[0].message
+            else:
+                subject = str(_(ADMIN_DIGEST_EMAIL_SUBJECT))
+                message = render_to_string('emails/admin_digest.html', {'emails': group})
+            try:
+                HajniCoursesEmail(to=list(recipients), subject=subject, message=message).send(fail_silently=False)
+                error = None
+            except Exception as e:
+                error = e
+            errors.append((group, error))
+        with transaction.atomic():
+            for group, error in errors:
+                for notification in group:
+                    notification._save_result(error)
+        return len(notifications)
+
+    @classmethod
+    def delete_sent(cls, sent_before, batch_size: int) -> int:
+        """
+        Deletes a batch of the emails sent before the given time. Returns the number of deleted emails.
+        """
+        with transaction.atomic():
+            email_ids = list(cls.objects.filter(status=cls.Status.SENT, sent_at__lt=sent_before)
+                             .order_by('sent_at').values_list('pk', flat=True)[:batch_size])
+            if not email_ids:
+                return 0
+            deleted, _deleted_per_model = cls.objects.filter(pk__in=email_ids).delete()
+        return deleted
+
+    def _send_email(self):
+        HajniCoursesEmail(to=self.recipients, subject=self.subject, message=self.message).send(fail_silently=False)
+
+    def _save_result(self, error: Exception | None):
+        """
+        Records the outcome of a sending. A failed sending is retried with exponential backoff until
+        EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+        """
+        if error is None:
+            self.status = self.Status.SENT
+            self.sent_at = timezone.now()
+        else:
+            self.attempts += 1
+            self.last_error = str(error)
+            if self.attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+                self.status = self.Status.FAILED
+                logger.error('Giving up sending email {} to {} after {} attempts: {}'.format(
+                    self.pk, self.recipients, self.attempts, self.last_error))
+            else:
+                delay = min(EMAIL_OUTBOX_RETRY_BASE_DELAY * 2 ** (self.attempts - 1), EMAIL_OUTBOX_RETRY_MAX_DELAY)
+                self.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        self.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+
+    def send(self):
+        """
+        Sends the email from the current thread and records the outcome.
+        """
+        try:
+            self._send_email()
+        except Exception as e:
+            self._save_result(e)
+        else:
+            self._save_result(None)
+
+
+class DownloadableFile(models.Model):
+    """
+    File of the downloads page. The content is stored only once under its SHA-256 hash, the group and the name of
+    the file are metadata, so the same content can be listed in more groups and under more names.
+    """
+    group = models.CharField(max_length=150)
+    name = models.CharField(max_length=250, blank=True)
+    blob = models.FileField(storage=ContentAddressedStorage())
+    size = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['group', 'name']
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'name'], name='downloadablefile_unique_name'),
+        ]
+
+    def __str__(self):
+        return '{} / {}'.format(self.group, self.name)
+
+    @property
+    def sha256(self) -> str:
+        return os.path.splitext(os.path.basename(self.blob.name))[0]
+
+    @property
+    def path(self) -> str:
+        """Returns the path of the content relative to MEDIA_ROOT."""
+        return '{}/{}'.format(DOWNLOADS_BLOB_DIRECTORY, self.blob.name)
+
+    def save(self, *args, **kwargs):
+        """
+        Overriding the save method to name the file after the uploaded one by default and to store its size.
+        """
+        if not self.name:
+            self.name = os.path.basename(self.blob.name)
+        self.size = self.blob.size
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def delete_blob_if_unused(cls, blob_name: str):
+        """
+        Deletes the stored content after the transaction is committed if no file refers to it anymore.
+        """
+        def delete():
+            if not cls.objects.filter(blob=blob_name).exists():
+                cls._meta.get_field('blob').storage.delete(blob_name)
+
+        transaction.on_commit(delete)
@@ -0,0 +1,46 @@
+import time
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStore(CachedDBStore):
+    """
+    Session store reading the sessions from the cache and writing them through to the UserSession model, together
+    with the id of the logged-in user.
+    SESSION_SAVE_EVERY_REQUEST slides the expiry of the sessions, but an unchanged session is written only when
+    SESSION_REFRESH_FRACTION of SESSION_COOKIE_AGE has passed since it was last written, so most requests do not
+    write the database.
+    """
+    # time of the last write of the session, stored in the session data
+    REFRESHED_AT_KEY = '_refreshed_at'
+
+    @classmethod
+    def get_model_class(cls):
+        # imported here to avoid loading the models before the apps are ready
+        from hajni_courses_app.models import UserSession
+        return UserSession
+
+    def create_model_instance(self, data):
+        """
+        Overriding the create_model_instance method to populate the user of the session.
+        """
+        obj = super().create_model_instance(data)
+        try:
+            obj.user_id = int(data.get(SESSION_KEY))
+        except (TypeError, ValueError):
+            obj.user_id = None
+        return obj
+
+    def save(self, must_create=False):
+        """
+        Overriding the save method to skip writing an unchanged session whose expiry was refreshed recently.
+        """
+        now = int(time.time())
+        if not must_create and self.session_key and not self.modified:
+            refreshed_at = self._get_session().get(self.REFRESHED_AT_KEY)
+            if refreshed_at is not None and \
+                    now - refreshed_at < settings.SESSION_COOKIE_AGE * settings.SESSION_REFRESH_FRACTION:
+                return
+        self[self.REFRESHED_AT_KEY] = now
+        super().save(must_create)
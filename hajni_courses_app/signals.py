@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from hajni_courses_app.models import CustomUser, Course, DownloadableFile
+from hajni_courses_app.utils.constants import ADMIN_EMAILS_CACHE_KEY
+from hajni_courses_app.utils.course_listing import CourseListing
+from hajni_courses_app.utils.downloads import invalidate_manifest
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_admin_emails(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalidates the cached superuser email addresses after the commit of a user change, so that they are not cached
+    again from the old data in the meantime. Saving only the last login (on every login) cannot change them.
+    """
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: cache.delete(ADMIN_EMAILS_CACHE_KEY))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_lists(sender, instance, **kwargs):
+    """
+    Invalidates the cached course lists after the commit of a course change, so that they are not cached again from
+    the old data in the meantime.
+    """
+    transaction.on_commit(CourseListing.invalidate)
+
+
+@receiver(pre_save, sender=DownloadableFile)
+def remember_previous_blob(sender, instance, **kwargs):
+    """
+    Remembers the content the file referred to before, so that it can be deleted when it is not used anymore.
+    """
+    instance._previous_blob = sender.objects.filter(pk=instance.pk).values_list('blob', flat=True).first() \
+        if instance.pk else None
+
+
+@receiver(post_save, sender=DownloadableFile)
+def downloadable_file_saved(sender, instance, **kwargs):
+    """
+    Deletes the previous content if it is not used anymore and invalidates the downloads manifest after the
+    commit, so that it is not rebuilt from the old data in the meantime.
+    """
+    previous_blob = getattr(instance, '_previous_blob', None)
+    if previous_blob and previous_blob != instance.blob.name:
+        sender.delete_blob_if_unused(previous_blob)
+    transaction.on_commit(invalidate_manifest)
+
+
+@receiver(post_delete, sender=DownloadableFile)
+def downloadable_file_deleted(sender, instance, **kwargs):
+    """
+    Deletes the content if it is not used anymore and invalidates the downloads manifest after the commit.
+    """
+    sender.delete_blob_if_unused(instance.blob.name)
+    transaction.on_commit(invalidate_manifest)
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+from hajni_courses_app.utils.constants import DOWNLOADS_BLOB_DIRECTORY, STATIC_FILES_COMPRESSED_EXTENSIONS
+
+try:
+    import brotli
+except ImportError:  # the .br files are not generated without the Brotli package
+    brotli = None
+
+
+@deconstructible(path='hajni_courses_app.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage saving every file under its SHA-256 hash (`ab/abcd...ef.pdf`), so the same content is stored only
+    once and a stored file never changes. By default the files are stored in the DOWNLOADS_BLOB_DIRECTORY folder of
+    MEDIA_ROOT.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, os.path.join(settings.MEDIA_ROOT, DOWNLOADS_BLOB_DIRECTORY))
+
+    @staticmethod
+    def hash_content(content) -> str:
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        return sha256.hexdigest()
+
+    def save(self, name, content, max_length=None):
+        """
+        Overriding the save method to name the file after its hash. The file is written only if the same content
+        is not stored yet.
+        """
+        sha256 = self.hash_content(content)
+        name = '{}/{}{}'.format(sha256[:2], sha256, os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def _save(self, name, content):
+        """
+        Overriding the _save method to write the file under a temporary name first, so a file named after its hash
+        is always complete, even while the same content is saved concurrently.
+        """
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(full_path), delete=False) as temp_file:
+            try:
+                for chunk in content.chunks():
+                    temp_file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            except BaseException:
+                os.remove(temp_file.name)
+                raise
+        # the front-end server sending the files must be able to read them
+        os.chmod(temp_file.name, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+        os.replace(temp_file.name, full_path)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # the name is the hash of the content, an existing file has the same content
+        return name
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Static files storage of collectstatic saving the files under content hashed names too, with the staticfiles.json
+    manifest of the names, and saving a gzip (.gz) and a Brotli (.br) compressed version of the text files next to
+    them, so they are compressed only once.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if os.path.splitext(name)[1].lower() in STATIC_FILES_COMPRESSED_EXTENSIONS:
+                self._compress(name)
+
+    def _compress(self, name: str):
+        """
+        Saves the compressed versions of the file, if they are smaller than the file.
+        """
+        with self.open(name) as file:
+            content = file.read()
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for extension, compressed in variants.items():
+            if self.exists(name + extension):
+                self.delete(name + extension)
+            if len(compressed) < len(content):
+                self._save(name + extension, ContentFile(compressed))
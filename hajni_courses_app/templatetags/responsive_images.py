@@ -0,0 +1,43 @@
+import json
+from functools import lru_cache
+from django import template
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from hajni_courses_app.utils.constants import RESPONSIVE_IMAGE_DIRECTORY
+
+
+register = template.Library()
+
+
+@lru_cache(maxsize=1)
+def get_responsive_images() -> dict:
+    """
+    Returns the manifest of the resized images written by the generate_responsive_images command, read once per
+    process. It is empty if the command has not been run.
+    """
+    manifest_path = finders.find('{}/manifest.json'.format(RESPONSIVE_IMAGE_DIRECTORY))
+    if not manifest_path:
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+@register.simple_tag
+def responsive_image(name, sizes, **attributes):
+    """
+    Renders a static image as a <picture> with the AVIF and WebP versions of it in all the generated widths, so
+    the browser downloads the smallest one it supports that is large enough. The sizes attribute is the displayed
+    width of the image (e.g. '250px'), the other keyword arguments are the attributes of the <img> tag.
+    """
+    image = get_responsive_images().get(name)
+    img_attributes = format_html_join('', ' {}="{}"', attributes.items())
+    if image is None:
+        return format_html('<img src="{}"{}>', static(name), img_attributes)
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((image_format, ', '.join('{} {}w'.format(static(variant_name), width) for width, variant_name in variants),
+          sizes) for image_format, variants in image['variants'].items()))
+    return format_html('<picture>{}<img src="{}" width="{}" height="{}"{}></picture>', sources, static(name),
+                       image['width'], image['height'], img_attributes)
@@ -1,11 +1,25 @@
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.db.utils import Error
 from unittest.mock import Mock, patch
+from django.utils import timezone
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
+from mailersend.exceptions import MailerSendError
 
-from hajni_courses_app.models import CustomUser, Course
+from hajni_courses_app.models import CustomUser, Course, EmailOutbox, UserSession
+from hajni_courses_app.utils.constants import EMAIL_OUTBOX_CLAIM_TIMEOUT, EMAIL_OUTBOX_MAX_ATTEMPTS, \
+    EMAIL_OUTBOX_RETRY_BASE_DELAY, SENT_EMAIL_MAX_AGE, UNACTIVATED_ACCOUNT_MAX_AGE
 from hajni_courses_app.utils.AccountActivationTokenGenerator import account_activation_token
 from hajni_courses.utils import HajniCoursesEmail
 
@@ -43,6 +57,215 @@ class ModelsTestCase(TestCase):
         self.assertFalse(CustomUser.delete_user_profile(request))
 
 
+class UserSessionTestCase(TestCase):
+    """
+    Test cases for the sessions stored with their user.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_session_stores_the_user(self):
+        """Tests that the logged-in user is saved in the session row, an anonymous session has no user."""
+        user = CustomUser.objects.create_user(username='user', password='test_password')
+        client = Client()
+        client.force_login(user=user)
+        self.assertEqual(UserSession.objects.get(session_key=client.session.session_key).user_id, user.pk)
+        anonymous_client = Client()
+        session = anonymous_client.session
+        session['key'] = 'value'
+        session.save()
+        self.assertIsNone(UserSession.objects.get(session_key=session.session_key).user_id)
+
+    def test_02_logout_everywhere(self):
+        """Tests that all the sessions of the user are deleted and the other users stay logged in."""
+        user = CustomUser.objects.create_user(username='user', password='test_password')
+        other_user = CustomUser.objects.create_user(username='other_user', password='test_password')
+        for _ in range(3):
+            Client().force_login(user=user)
+        Client().force_login(user=other_user)
+        self.assertEqual(user.logout_everywhere(), 3)
+        self.assertFalse(UserSession.objects.filter(user=user).exists())
+        self.assertTrue(UserSession.objects.filter(user=other_user).exists())
+
+    def test_03_benchmark_session_deletion_command(self):
+        """Tests that the benchmark command runs and leaves no data behind."""
+        out = StringIO()
+        call_command('benchmark_session_deletion', '--sessions', '100', '--users', '10', '--legacy', stdout=out)
+        self.assertIn('Indexed delete: deleted 10 sessions', out.getvalue())
+        self.assertIn('Legacy full scan: deleted 10 sessions', out.getvalue())
+        self.assertFalse(UserSession.objects.exists())
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_04_session_written_only_when_expiry_is_stale(self):
+        """Tests that an unchanged session is not written on every request, only when its expiry gets stale."""
+        user = CustomUser.objects.create_user(username='user', password='test_password')
+        client = Client()
+        client.force_login(user=user)
+        session_key = client.session.session_key
+        expire_date = UserSession.objects.get(session_key=session_key).expire_date
+        client.get(reverse('home'))
+        self.assertEqual(UserSession.objects.get(session_key=session_key).expire_date, expire_date)
+        stale_after = settings.SESSION_COOKIE_AGE * settings.SESSION_REFRESH_FRACTION
+        with patch('hajni_courses_app.session_backend.time.time', return_value=time.time() + stale_after + 1):
+            client.get(reverse('home'))
+        self.assertGreater(UserSession.objects.get(session_key=session_key).expire_date, expire_date)
+
+    def test_05_logout_everywhere_deletes_cached_sessions(self):
+        """Tests that the sessions of the user are deleted from the cache too."""
+        user = CustomUser.objects.create_user(username='user', password='test_password')
+        client = Client()
+        client.force_login(user=user)
+        client.get(reverse('home'))
+        self.assertIn(SESSION_KEY, client.session)
+        user.logout_everywhere()
+        self.assertNotIn(SESSION_KEY, client.session)
+        response = client.get(reverse('home'))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+
+class PruneStaleDataTestCase(TestCase):
+    """
+    Test cases for deleting the expired sessions and the accounts never activated.
+    """
+
+    def _create_session(self, user=None, expired=False):
+        expire_date = timezone.now() + timedelta(days=-1 if expired else 1)
+        return UserSession.objects.create(session_key=uuid.uuid4().hex, session_data='', expire_date=expire_date,
+                                          user=user)
+
+    def test_01_delete_expired_sessions(self):
+        """Tests that the expired sessions are deleted in batches and the valid ones are kept."""
+        for _ in range(5):
+            self._create_session(expired=True)
+        valid_session = self._create_session()
+        self.assertEqual(UserSession.delete_expired(batch_size=2), 2)
+        self.assertEqual(UserSession.objects.count(), 4)
+        out = StringIO()
+        call_command('prune_stale_data', '--batch-size', '2', '--pause', '0', stdout=out)
+        self.assertIn('Deleted 2 expired sessions (2 in total', out.getvalue())
+        self.assertIn('Deleted 1 expired sessions (3 in total', out.getvalue())
+        self.assertEqual(list(UserSession.objects.all()), [valid_session])
+
+    def test_02_delete_unactivated_accounts(self):
+        """Tests that only the old accounts never activated are deleted, with their sessions."""
+        long_ago = timezone.now() - timedelta(days=UNACTIVATED_ACCOUNT_MAX_AGE + 1)
+        unactivated = CustomUser.objects.create_user(username='unactivated', password='test_password',
+                                                     is_active=False, date_joined=long_ago)
+        self._create_session(user=unactivated)
+        CustomUser.objects.create_user(username='recently_joined', password='test_password', is_active=False)
+        CustomUser.objects.create_user(username='cancelled', password='test_password', is_active=False,
+                                       date_joined=long_ago, last_login=long_ago)
+        CustomUser.objects.create_user(username='active', password='test_password', date_joined=long_ago)
+        out = StringIO()
+        call_command('prune_stale_data', '--pause', '0', stdout=out)
+        self.assertIn('Deleted 1 accounts never activated.', out.getvalue())
+        self.assertEqual(set(CustomUser.objects.values_list('username', flat=True)),
+                         {'recently_joined', 'cancelled', 'active'})
+        self.assertFalse(UserSession.objects.exists())
+
+    def test_03_delete_sent_emails(self):
+        """Tests that only the emails sent before the retention period are deleted from the email outbox."""
+        long_ago = timezone.now() - timedelta(days=SENT_EMAIL_MAX_AGE + 1)
+        EmailOutbox.objects.create(recipients=['user@mail.com'], subject='old', message='message',
+                                   status=EmailOutbox.Status.SENT, sent_at=long_ago)
+        EmailOutbox.objects.create(recipients=['user@mail.com'], subject='recent', message='message',
+                                   status=EmailOutbox.Status.SENT, sent_at=timezone.now())
+        EmailOutbox.objects.create(recipients=['user@mail.com'], subject='failed', message='message',
+                                   status=EmailOutbox.Status.FAILED)
+        out = StringIO()
+        call_command('prune_stale_data', '--pause', '0', stdout=out)
+        self.assertIn('Deleted 1 sent emails.', out.getvalue())
+        self.assertEqual(set(EmailOutbox.objects.values_list('subject', flat=True)), {'recent', 'failed'})
+
+
+class AdminEmailsTestCase(TestCase):
+    """
+    Test cases for the cached superuser email addresses.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_admin_emails_are_cached(self):
+        """Tests that the superuser email addresses are only queried once."""
+        CustomUser.objects.create_user(username='superuser', password='test_password',
+                                       email='superuser@mail.com', is_superuser=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(CustomUser.get_admin_emails(), ['superuser@mail.com'])
+        with self.assertNumQueries(0):
+            self.assertEqual(CustomUser.get_admin_emails(), ['superuser@mail.com'])
+
+    def test_02_admin_emails_invalidated_on_user_changes(self):
+        """Tests that saving or deleting a user invalidates the cached email addresses, a login does not."""
+        superuser = CustomUser.objects.create_user(username='superuser', password='test_password',
+                                                   email='superuser@mail.com', is_superuser=True)
+        self.assertEqual(CustomUser.get_admin_emails(), ['superuser@mail.com'])
+        superuser.email = 'new_superuser@mail.com'
+        with self.captureOnCommitCallbacks(execute=True):
+            superuser.save()
+            # the cache is invalidated only after the commit
+            self.assertEqual(CustomUser.get_admin_emails(), ['superuser@mail.com'])
+        self.assertEqual(CustomUser.get_admin_emails(), ['new_superuser@mail.com'])
+        with self.captureOnCommitCallbacks(execute=True):
+            superuser.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            CustomUser.get_admin_emails()
+        with self.captureOnCommitCallbacks(execute=True):
+            superuser.delete()
+        self.assertEqual(CustomUser.get_admin_emails(), [])
+
+
+class CourseCardDataTestCase(TestCase):
+    """
+    Test cases for the course card data.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_card_data_populated_on_save(self):
+        """Tests that the card data is derived from the course fields when saving."""
+        course = Course.objects.create(name='Word (kezdő)', price=1234567, description='*one*two', duration='',
+                                       extra_info='')
+        self.assertEqual(course.short_name, 'WORD ')
+        self.assertEqual(course.description_items, ['', 'one', 'two'])
+        self.assertEqual(course.price_display, '1.234.567')
+        course.name = 'Excel'
+        course.save(update_fields=['name'])
+        course.refresh_from_db()
+        self.assertEqual(course.short_name, 'EXCEL')
+
+    def test_02_course_list_fetches_card_fields_only(self):
+        """Tests that the course list query does not fetch the long text fields."""
+        Course.objects.create(name='course_name', price=10000, description='*one*two', duration='', extra_info='')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('general_courses'))
+        course_query = queries.captured_queries[-1]['sql']
+        self.assertIn('short_name', course_query)
+        self.assertNotIn('extra_info', course_query)
+        self.assertNotIn('"description"', course_query)
+
+
+class CourseListPlansTestCase(TestCase):
+    """
+    Test cases for the query plans of the course lists.
+    """
+
+    def test_01_course_list_queries_use_index_scan(self):
+        """Tests that the course list queries are served by the partial indexes on a large course table."""
+        out = StringIO()
+        call_command('check_course_list_plans', '--courses', '20000', stdout=out)
+        self.assertIn('All course list queries use an index scan.', out.getvalue())
+        self.assertFalse(Course.objects.exists())
+
+    def test_02_no_listed_courses(self):
+        """Tests that the check fails with a clear message when no course is listed, and the seeding is rolled back."""
+        with self.assertRaisesMessage(CommandError, 'seed more courses with --courses'):
+            call_command('check_course_list_plans', '--courses', '0', stdout=StringIO())
+        self.assertFalse(Course.objects.exists())
+
+
 class ActivateAccountTestCase(TestCase):
     """
     Test cases for the user account activation.
@@ -84,3 +307,128 @@ class ActivateAccountTestCase(TestCase):
         response = self.client.post(reverse('activate_account', args=(uid, token)), follow=True)
         self.assertContains(response, '<div class="login_signup_errors">')
         self.assertContains(response, 'Az aktivációs link nem érvényes vagy hiba történt a fiókod aktiválása során.')
+
+
+class EmailOutboxTestCase(TestCase):
+    """
+    Test cases for the email outbox.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_enqueue(self):
+        """Tests that a single recipient and a QuerySet of recipients are both stored as a list."""
+        CustomUser.objects.create_user(username='superuser', password='test_password',
+                                       email='superuser@mail.com', is_superuser=True)
+        outbox_email = EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        self.assertEqual(outbox_email.recipients, ['user@mail.com'])
+        self.assertEqual(outbox_email.status, EmailOutbox.Status.PENDING)
+        outbox_email = EmailOutbox.enqueue(
+            to=CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True),
+            subject='subject', message='message')
+        self.assertEqual(outbox_email.recipients, ['superuser@mail.com'])
+
+    def test_02_emails_queued_on_user_changes(self):
+        """Tests that the user related emails are queued instead of being sent right away."""
+        CustomUser.objects.create_user(username='superuser', password='test_password',
+                                       email='superuser@mail.com', is_superuser=True)
+        user = CustomUser.objects.create_user(username='user', password='test_password', email='user@mail.com')
+        user.send_activation_link('localhost', 'http')
+        user.cancel_user()
+        Course.send_application({'first_name': 'first_name', 'last_name': 'last_name', 'age': 50,
+                                 'address': 'address', 'email': 'user@mail.com', 'phone_number': '',
+                                 'experience': '', 'course': 'course_name'})
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.Status.PENDING).count(), 4)
+
+    def test_03_send_pending(self):
+        """Tests that the due emails are sent and the ones scheduled for later are left alone."""
+        EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        later = EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        later.next_attempt_at = timezone.now() + timedelta(hours=1)
+        later.save()
+        self.assertEqual(EmailOutbox.send_pending(), 1)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.Status.SENT).count(), 1)
+        self.assertEqual(EmailOutbox.send_pending(), 0)
+
+    def test_04_send_failure_is_retried_with_backoff(self):
+        """Tests that a failed sending is rescheduled with exponential backoff and finally given up."""
+        outbox_email = EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        with patch.object(HajniCoursesEmail, 'send', side_effect=MailerSendError('Test error')):
+            before = timezone.now()
+            outbox_email.send()
+            self.assertEqual(outbox_email.status, EmailOutbox.Status.PENDING)
+            self.assertEqual(outbox_email.attempts, 1)
+            self.assertGreaterEqual(outbox_email.next_attempt_at,
+                                    before + timedelta(seconds=EMAIL_OUTBOX_RETRY_BASE_DELAY))
+            outbox_email.send()
+            self.assertGreaterEqual(outbox_email.next_attempt_at,
+                                    before + timedelta(seconds=2 * EMAIL_OUTBOX_RETRY_BASE_DELAY))
+            for _ in range(EMAIL_OUTBOX_MAX_ATTEMPTS - 2):
+                outbox_email.send()
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, EmailOutbox.Status.FAILED)
+        self.assertEqual(outbox_email.last_error, 'Test error')
+
+    def test_05_send_queued_emails_command(self):
+        """Tests that the worker command sends the due emails and exits when running once."""
+        for _ in range(3):
+            EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        out = StringIO()
+        call_command('send_queued_emails', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn('Processed 3 emails.', out.getvalue())
+        self.assertFalse(EmailOutbox.objects.filter(status=EmailOutbox.Status.PENDING).exists())
+
+    def test_06_admin_notifications_are_digested(self):
+        """Tests that the admin notifications are collected and sent as one email, the user confirmation is not."""
+        CustomUser.objects.create_user(username='superuser', password='test_password',
+                                       email='superuser@mail.com', is_superuser=True)
+        user = CustomUser.objects.create_user(username='user', password='test_password', phone_number='0036301234567')
+        CustomUser.send_callback_request(user)
+        Course.send_application({'first_name': 'first_name', 'last_name': 'last_name', 'age': 50,
+                                 'address': 'address', 'email': 'user@mail.com', 'phone_number': '',
+                                 'experience': '', 'course': 'course_name'})
+        self.assertEqual(EmailOutbox.objects.filter(digest=True).count(), 2)
+        # the confirmation goes out right away, the admin notifications wait for the digest window
+        self.assertEqual(EmailOutbox.send_pending(), 1)
+        self.assertEqual(EmailOutbox.send_admin_digest(), 0)
+        with patch.object(HajniCoursesEmail, '__init__', return_value=None) as email_mock:
+            with patch.object(HajniCoursesEmail, 'send') as send_mock:
+                self.assertEqual(EmailOutbox.send_admin_digest(window=0), 2)
+        email_mock.assert_called_once()
+        send_mock.assert_called_once_with(fail_silently=False)
+        self.assertEqual(email_mock.call_args.kwargs['to'], ['superuser@mail.com'])
+        self.assertIn('course_name', email_mock.call_args.kwargs['message'])
+        self.assertIn('0036301234567', email_mock.call_args.kwargs['message'])
+        self.assertFalse(EmailOutbox.objects.filter(status=EmailOutbox.Status.PENDING).exists())
+
+    def test_07_claimed_emails_postponed_while_sending(self):
+        """Tests that the claimed emails are postponed before sending, so another worker does not send them."""
+        outbox_email = EmailOutbox.enqueue(to='user@mail.com', subject='subject', message='message')
+        before = timezone.now()
+        # the worker stops before saving the result
+        with patch.object(EmailOutbox, '_save_result'):
+            self.assertEqual(EmailOutbox.send_pending(), 1)
+        self.assertEqual(EmailOutbox.send_pending(), 0)
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, EmailOutbox.Status.PENDING)
+        self.assertGreaterEqual(outbox_email.next_attempt_at, before + timedelta(seconds=EMAIL_OUTBOX_CLAIM_TIMEOUT))
+
+    def test_08_claimed_digest_postponed_while_sending(self):
+        """Tests that the claimed admin notifications are postponed before the digest is sent."""
+        notification = EmailOutbox.enqueue(to='superuser@mail.com', subject='subject', message='message', digest=True)
+        before = timezone.now()
+        # the worker stops before saving the result
+        with patch.object(HajniCoursesEmail, 'send'), patch.object(EmailOutbox, '_save_result'):
+            self.assertEqual(EmailOutbox.send_admin_digest(window=0), 1)
+        self.assertEqual(EmailOutbox.send_admin_digest(window=0), 0)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, EmailOutbox.Status.PENDING)
+        self.assertGreaterEqual(notification.next_attempt_at, before + timedelta(seconds=EMAIL_OUTBOX_CLAIM_TIMEOUT))
+
+    def test_09_admin_notification_without_superusers_not_queued(self):
+        """Tests that no admin notification is queued while there is no superuser to send it to."""
+        user = CustomUser.objects.create_user(username='user', password='test_password', phone_number='0036301234567')
+        CustomUser.send_callback_request(user)
+        self.assertIsNone(EmailOutbox.enqueue(to=[], subject='subject', message='message', digest=True))
+        self.assertFalse(EmailOutbox.objects.exists())
@@ -0,0 +1,140 @@
+import io
+import os
+import tempfile
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from hajni_courses import settings
+from hajni_courses_app import urls
+from hajni_courses_app.models import CustomUser, Course, DownloadableFile, UserSession
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Test cases checking that the views stay within their SQL query budget and response size, for the anonymous and
+    the logged-in users, on a database seeded with realistic data.
+    """
+    # URL name -> user type -> (queries of the first request with empty caches, queries of the next request)
+    # The budgets are the sum of the queries a view needs, lower one when a view gets cheaper, but raise one only for
+    # a query the view really needs:
+    # - the session of a logged-in user: 1 on the first request, then it is cached
+    # - the user of the session: 1 on every request of the views using request.user
+    # - the superuser emails (home, privacy notice): 1 on the first request, then they are cached
+    # - the course lists: the page index and the page, then they are cached
+    # - the course page: the time of its last change for the ETag and the course, on every request
+    # - the course of the apply page, and the user of the activation link: 1 on every request
+    # - the downloads manifest: 1 on the first request, then it is cached
+    # The anonymous users are redirected from the pages requiring a login without any query.
+    QUERY_BUDGETS = {
+        'home': {'anonymous': (1, 0), 'user': (3, 1)},
+        'login': {'anonymous': (0, 0), 'user': (2, 1)},
+        'signup': {'anonymous': (0, 0), 'user': (2, 1)},
+        'activate_account': {'anonymous': (1, 1), 'user': (2, 1)},
+        'change_password': {'anonymous': (0, 0), 'user': (2, 1)},
+        'personal_data': {'anonymous': (0, 0), 'user': (2, 1)},
+        'delete_profile': {'anonymous': (0, 0), 'user': (2, 1)},
+        'pensioner_courses': {'anonymous': (2, 0), 'user': (4, 1)},
+        'general_courses': {'anonymous': (2, 0), 'user': (4, 1)},
+        'course': {'anonymous': (2, 2), 'user': (4, 3)},
+        'apply': {'anonymous': (0, 0), 'user': (3, 2)},
+        'privacy_notice': {'anonymous': (1, 0), 'user': (3, 1)},
+        'downloads': {'anonymous': (1, 0), 'user': (3, 1)},
+        'download_group': {'anonymous': (0, 0), 'user': (3, 1)},
+        'download_file': {'anonymous': (0, 0), 'user': (3, 1)},
+        'metrics': {'anonymous': (0, 0), 'user': (1, 0)},
+    }
+    # URL name -> maximum size of the rendered page in bytes, for both user types
+    SIZE_BUDGETS = {
+        'home': 9000,
+        'pensioner_courses': 15000,
+        'general_courses': 15000,
+        'course': 5000,
+        'privacy_notice': 45000,
+        'downloads': 6000,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        """Uses a temporary media root for the downloadable files imported by setUpTestData."""
+        media_root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media_root.cleanup)
+        cls.files_path = os.path.join(settings.MEDIA_ROOT, 'files')
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root.name))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        """Seeds the database with courses, users and their sessions, and downloadable files."""
+        Course.objects.bulk_create([
+            Course(name='Course {}'.format(i), slug='course-{}'.format(i), price=10000 + i * 1000,
+                   description='*Basics*Practice on a computer*Working with files*Questions and answers',
+                   duration='{} times 90 minutes'.format(i % 5 + 3), extra_info='Small groups.',
+                   for_pensioners=i % 3 != 0, for_non_pensioners=i % 3 != 1, active=i % 10 != 0)
+            for i in range(1, 101)])
+        for course in Course.objects.all():
+            # populates the card data
+            course.save()
+        cls.course = Course.objects.filter(active=True, for_pensioners=True, for_non_pensioners=True).first()
+        CustomUser.objects.create_superuser(username='admin', password='admin_password', email='admin@mail.com')
+        CustomUser.objects.create_superuser(username='admin2', password='admin_password', email='admin2@mail.com')
+        CustomUser.objects.bulk_create([CustomUser(username='user{}'.format(i), email='user{}@mail.com'.format(i),
+                                                   phone_number='00363012345{:02d}'.format(i), is_active=i % 4 != 0)
+                                        for i in range(100)])
+        cls.user = CustomUser.objects.create_user(username='user', password='test_password', email='user@mail.com',
+                                                  phone_number='0036301234567')
+        UserSession.objects.bulk_create([
+            UserSession(session_key='session{}'.format(i), user=cls.user, expire_date='2100-01-01T00:00Z',
+                        session_data=SessionBase().encode({}))
+            for i in range(10)])
+        call_command('import_downloads', cls.files_path, stdout=io.StringIO())
+        cls.file = DownloadableFile.objects.order_by('pk').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def _url(self, name: str) -> str:
+        args = {
+            # an invalid token of an existing user, as sent by the bots
+            'activate_account': [urlsafe_base64_encode(force_bytes(self.user.pk)), 'invalid-token'],
+            'course': [self.course.slug],
+            'apply': [self.course.slug],
+            'download_group': [self.file.group],
+            'download_file': [self.file.sha256, self.file.name],
+        }
+        return reverse(name, args=args.get(name, []))
+
+    def _check_budgets(self, user_type: str):
+        for name, budgets in self.QUERY_BUDGETS.items():
+            with self.subTest(name=name):
+                url = self._url(name)
+                cache.clear()
+                for request, budget in zip(('first', 'next'), budgets[user_type]):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(url)
+                    # the test client closes the response, a streaming one once its content is read
+                    content = b''.join(response.streaming_content) if response.streaming else response.content
+                    self.assertLessEqual(len(queries), budget, msg='{} request of {} for the {} user:\n{}'.format(
+                        request, url, user_type, '\n'.join(query['sql'] for query in queries.captured_queries)))
+                if name in self.SIZE_BUDGETS:
+                    self.assertLessEqual(len(content), self.SIZE_BUDGETS[name], msg=url)
+
+    def test_01_budget_of_every_url(self):
+        """Tests that every URL name of the app has a query budget."""
+        url_names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertSetEqual(url_names, set(self.QUERY_BUDGETS))
+
+    def test_02_anonymous_query_budgets(self):
+        """Tests that the views stay within their query budget for the anonymous users."""
+        self._check_budgets('anonymous')
+
+    def test_03_user_query_budgets(self):
+        """Tests that the views stay within their query budget for the logged-in users."""
+        self.client.force_login(self.user)
+        self._check_budgets('user')
@@ -0,0 +1,420 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from io import StringIO
+from PIL import Image
+from unittest.mock import Mock, patch
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from hajni_courses_app.models import CustomUser, DownloadableFile
+from hajni_courses_app.templatetags.responsive_images import responsive_image
+from hajni_courses_app.utils import downloads, metrics
+from hajni_courses_app.utils.cache import get_or_render, bump_version, try_lock
+from hajni_courses_app.utils.constants import RESPONSIVE_IMAGES
+from hajni_courses_app.utils.sql_inspection import QueryInspector, RepeatedQueryError
+
+
+class CacheUtilsTestCase(TestCase):
+    """
+    Test cases for the cache utils.
+    """
+
+    def setUp(self):
+        cache.clear()
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.enterContext(self.settings(CACHE_LOCK_DIR=lock_dir.name))
+
+    def test_01_get_or_render(self):
+        """Tests that the value is rendered once and rendered again after the version is bumped."""
+        render = Mock(side_effect=['first', 'second'])
+        self.assertEqual(get_or_render('key', 'version_key', render, 60), 'first')
+        self.assertEqual(get_or_render('key', 'version_key', render, 60), 'first')
+        bump_version('version_key')
+        self.assertEqual(get_or_render('key', 'version_key', render, 60), 'second')
+        self.assertEqual(render.call_count, 2)
+
+    def test_02_outdated_value_served_while_locked(self):
+        """Tests that the outdated value is served while another process regenerates it."""
+        get_or_render('key', 'version_key', lambda: 'outdated', 60)
+        bump_version('version_key')
+        self.enterContext(try_lock('key'))
+        render = Mock(return_value='new')
+        self.assertEqual(get_or_render('key', 'version_key', render, 60), 'outdated')
+        render.assert_not_called()
+
+    def test_03_wait_for_missing_value_while_locked(self):
+        """Tests that a missing value is waited for while another process renders it, and rendered at the deadline."""
+        self.enterContext(try_lock('key'))
+        render = Mock(return_value='value')
+        with patch('hajni_courses_app.utils.cache.CACHE_LOCK_WAIT', 0.2):
+            self.assertEqual(get_or_render('key', 'version_key', render, 60), 'value')
+        render.assert_called_once()
+        # the value rendered at the deadline is not cached, the lock holder will cache it
+        self.assertIsNone(cache.get('key'))
+
+    def test_04_try_lock(self):
+        """Tests that a key can be locked only once at a time, and it can be locked again after the release."""
+        lock_file = try_lock('key')
+        self.assertIsNotNone(lock_file)
+        self.assertIsNone(try_lock('key'))
+        other_lock_file = try_lock('other_key')
+        self.assertIsNotNone(other_lock_file)
+        other_lock_file.close()
+        lock_file.close()
+        lock_file = try_lock('key')
+        self.assertIsNotNone(lock_file)
+        lock_file.close()
+
+
+class DownloadsManifestTestCase(TestCase):
+    """
+    Test cases for the manifest and the storage of the downloadable files.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=self.media_root.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_file('Second Group', 'b.pdf', b'second file')
+            self._create_file('First Group', 'b.pdf', b'second file')
+            self._create_file('First Group', 'a.pdf', b'first file')
+
+    @staticmethod
+    def _create_file(group, name, content):
+        downloadable_file = DownloadableFile(group=group, name=name)
+        downloadable_file.blob.save(name, ContentFile(content))
+        return downloadable_file
+
+    def test_01_build_manifest(self):
+        """Tests that the files are grouped and sorted, with their size, hash and path."""
+        manifest = downloads.get_manifest()
+        self.assertEqual([group['name'] for group in manifest['file_groups']], ['First Group', 'Second Group'])
+        files = manifest['file_groups'][0]['files']
+        self.assertEqual([file['name'] for file in files], ['a.pdf', 'b.pdf'])
+        sha256 = hashlib.sha256(b'first file').hexdigest()
+        self.assertEqual(files[0]['size'], len(b'first file'))
+        self.assertEqual(files[0]['sha256'], sha256)
+        self.assertEqual(files[0]['path'], 'blobs/{}/{}.pdf'.format(sha256[:2], sha256))
+        with open(os.path.join(self.media_root.name, files[0]['path']), 'rb') as file:
+            self.assertEqual(file.read(), b'first file')
+
+    def test_02_identical_content_stored_once(self):
+        """Tests that the same content is stored once and deleted when no file refers to it anymore."""
+        sha256 = hashlib.sha256(b'second file').hexdigest()
+        blob_directory = os.path.join(self.media_root.name, 'blobs', sha256[:2])
+        self.assertEqual(os.listdir(blob_directory), ['{}.pdf'.format(sha256)])
+        with self.captureOnCommitCallbacks(execute=True):
+            DownloadableFile.objects.get(group='First Group', name='b.pdf').delete()
+        self.assertTrue(os.path.exists(os.path.join(blob_directory, '{}.pdf'.format(sha256))))
+        with self.captureOnCommitCallbacks(execute=True):
+            second_file = DownloadableFile.objects.get(group='Second Group', name='b.pdf')
+            second_file.blob.save('b.pdf', ContentFile(b'second file changed'))
+        self.assertFalse(os.path.exists(os.path.join(blob_directory, '{}.pdf'.format(sha256))))
+
+    def test_03_manifest_cached_until_a_file_changes(self):
+        """Tests that the cached manifest is used until a downloadable file changes."""
+        downloads.get_manifest()
+        with self.assertNumQueries(0):
+            downloads.get_manifest()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_file('Third Group', 'c.pdf', b'third file')
+        self.assertEqual(len(downloads.get_manifest()['file_groups']), 3)
+
+    def test_04_stream_zip(self):
+        """Tests that the compressed files are stored and the others are deflated in the streamed ZIP archive."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_file('First Group', 'c.txt', b'text ' * 1000)
+        group = downloads.get_group('First Group')
+        with zipfile.ZipFile(io.BytesIO(b''.join(downloads.stream_zip(group)))) as archive:
+            self.assertEqual(archive.getinfo('a.pdf').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.getinfo('c.txt').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.read('c.txt'), b'text ' * 1000)
+            self.assertEqual(archive.read('b.pdf'), b'second file')
+
+    def test_05_import_downloads_command(self):
+        """Tests that the command imports a directory with a group per folder and skips the unchanged files."""
+        import_directory = os.path.join(self.media_root.name, 'files')
+        os.makedirs(os.path.join(import_directory, 'new_group'))
+        for file_name, content in (('a.pdf', b'first file'), ('c.pdf', b'third file')):
+            with open(os.path.join(import_directory, 'new_group', file_name), 'wb') as file:
+                file.write(content)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_downloads', import_directory, stdout=out)
+        self.assertIn('Imported 2 files, 0 files were unchanged.', out.getvalue())
+        group = downloads.get_group('New Group')
+        self.assertEqual([file['name'] for file in group['files']], ['a.pdf', 'c.pdf'])
+        self.assertEqual(group['files'][0]['path'], downloads.get_group('First Group')['files'][0]['path'])
+        call_command('import_downloads', import_directory, stdout=out)
+        self.assertIn('Imported 0 files, 2 files were unchanged.', out.getvalue())
+
+
+class RangeParsingTestCase(TestCase):
+    """
+    Test cases for parsing the Range header of the downloads.
+    """
+
+    def test_01_valid_ranges(self):
+        """Tests that the ranges are limited to the file, sorted and merged."""
+        self.assertEqual(downloads.parse_ranges('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(downloads.parse_ranges('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(downloads.parse_ranges('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(downloads.parse_ranges('bytes=-2000', 1000), [(0, 999)])
+        self.assertEqual(downloads.parse_ranges('bytes=990-2000', 1000), [(990, 999)])
+        self.assertEqual(downloads.parse_ranges('bytes=500-599, 0-9,10-19, 5-7', 1000), [(0, 19), (500, 599)])
+
+    def test_02_invalid_ranges(self):
+        """Tests that an invalid header is ignored and an unsatisfiable one gives no ranges."""
+        for header in ('items=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-b', 'bytes=-', 'bytes=+1-2',
+                       'bytes=' + ','.join(['0-1'] * 17)):
+            self.assertIsNone(downloads.parse_ranges(header, 1000))
+        self.assertEqual(downloads.parse_ranges('bytes=1000-', 1000), [])
+        self.assertEqual(downloads.parse_ranges('bytes=-0', 1000), [])
+
+
+class StaticFilesTestCase(TestCase):
+    """
+    Test cases for collecting and serving the hashed and precompressed static files.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Collects the static files once, compressing them takes a few seconds."""
+        super().setUpClass()
+        static_root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(static_root.cleanup)
+        cls.static_root = static_root.name
+        cls.enterClassContext(override_settings(
+            STATIC_ROOT=cls.static_root,
+            STORAGES={'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                      'staticfiles': {'BACKEND': 'hajni_courses_app.storage.CompressedManifestStaticFilesStorage'}}))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(cls.static_root, 'staticfiles.json')) as manifest:
+            cls.hashed_css = json.load(manifest)['paths']['style/style.css']
+
+    def test_01_collectstatic(self):
+        """Tests that the static files are saved under hashed names with their compressed versions."""
+        self.assertRegex(self.hashed_css, r'^style/style\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.static_root, self.hashed_css), 'rb') as css_file, \
+                gzip.open(os.path.join(self.static_root, self.hashed_css + '.gz')) as compressed_file:
+            self.assertEqual(compressed_file.read(), css_file.read())
+        self.assertFalse(os.path.exists(os.path.join(self.static_root, 'logo.jpeg.gz')))
+
+    def test_02_serve_compressed_hashed_file(self):
+        """Tests that the compressed version of a hashed file is sent when accepted and can be cached forever."""
+        response = self.client.get('/static/' + self.hashed_css, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'public', 'max-age=31536000', 'immutable'})
+        with open(os.path.join(self.static_root, self.hashed_css), 'rb') as css_file:
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), css_file.read())
+
+    def test_03_serve_uncompressed_unhashed_file(self):
+        """Tests that the file is sent uncompressed if the browser refuses gzip, and an unhashed name is revalidated."""
+        response = self.client.get('/static/style/style.css', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'public', 'max-age=3600'})
+
+    def test_04_missing_static_file(self):
+        """Tests that the missing files and the paths outside STATIC_ROOT are not served."""
+        for path in ('/static/missing.css', '/static/../manage.py', '/static/%2e%2e/manage.py'):
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class ResponsiveImagesTestCase(TestCase):
+    """
+    Test cases for the resized images and the responsive_image template tag.
+    """
+
+    def test_01_responsive_image_tag(self):
+        """Tests that the image is rendered as a picture with the AVIF and WebP versions in every width."""
+        html = responsive_image('hajni_image.jpeg', '250px', id='img_photo')
+        self.assertTrue(html.startswith('<picture><source type="image/avif" srcset="/static/responsive/'
+                                        'hajni_image-240.avif 240w, /static/responsive/hajni_image-480.avif 480w, '
+                                        '/static/responsive/hajni_image-720.avif 720w" sizes="250px">'
+                                        '<source type="image/webp"'))
+        self.assertTrue(html.endswith('<img src="/static/hajni_image.jpeg" width="1181" height="1171" '
+                                      'id="img_photo"></picture>'))
+
+    def test_02_responsive_image_tag_without_resized_versions(self):
+        """Tests that an image without resized versions is rendered as a simple img tag."""
+        self.assertEqual(responsive_image('logo.jpeg', '100px', id='logo', alt='<logo>'),
+                         '<img src="/static/logo.jpeg" id="logo" alt="&lt;logo&gt;">')
+
+    def test_03_generate_responsive_images_command(self):
+        """Tests that the resized versions are generated in the widths not larger than the image."""
+        static_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(static_dir.cleanup)
+        source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+        for name in RESPONSIVE_IMAGES:
+            shutil.copy(os.path.join(source_dir, name), static_dir.name)
+        out = StringIO()
+        call_command('generate_responsive_images', '--static-dir', static_dir.name, stdout=out)
+        self.assertIn('general_courses_image.png: 2 widths in avif, webp', out.getvalue())
+        with open(os.path.join(static_dir.name, 'responsive', 'manifest.json')) as manifest_file:
+            content = manifest_file.read()
+        self.assertTrue(content.endswith('}\n'))
+        image = json.loads(content)['general_courses_image.png']
+        self.assertEqual((image['width'], image['height']), (331, 288))
+        self.assertEqual(image['variants']['webp'], [[240, 'responsive/general_courses_image-240.webp'],
+                                                     [331, 'responsive/general_courses_image-331.webp']])
+        with Image.open(os.path.join(static_dir.name, 'responsive', 'general_courses_image-240.webp')) as resized:
+            self.assertEqual(resized.size, (240, 209))
+
+
+class MetricsTestCase(TestCase):
+    """
+    Test cases for the request metrics.
+    """
+
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.metrics_dir = metrics_dir.name
+        self.enterContext(self.settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='secret'))
+
+    def _get_metrics(self):
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_01_request_metrics(self):
+        """Tests that the requests are recorded per URL name with their queries and response size."""
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        self.client.get('/not-found')
+        content = self._get_metrics()
+        self.assertIn('# TYPE hajni_courses_request_duration_seconds histogram\n', content)
+        self.assertIn('hajni_courses_requests_total{status="200",view="home"} 2.0\n', content)
+        self.assertIn('hajni_courses_requests_total{status="404",view="unresolved"} 1.0\n', content)
+        self.assertIn('hajni_courses_request_duration_seconds_bucket{le="+Inf",view="home"} 2.0\n', content)
+        self.assertIn('hajni_courses_request_duration_seconds_count{view="home"} 2.0\n', content)
+        self.assertRegex(content, r'hajni_courses_request_db_queries_sum\{view="home"\} [1-9]')
+        self.assertRegex(content, r'hajni_courses_response_size_bytes_sum\{view="home"\} [1-9]')
+        buckets = re.findall(r'hajni_courses_request_db_queries_bucket\{le="([^"]+)",view="home"\}', content)
+        self.assertEqual(buckets, ['0', '1', '2', '5', '10', '20', '50', '100', '+Inf'])
+
+    def test_02_metrics_of_processes_summed(self):
+        """Tests that the metrics files of all the processes are summed, and a file grows for many keys."""
+        other_process_file = metrics.MetricsFile(os.path.join(self.metrics_dir, 'metrics_1.db'))
+        for i in range(3000):
+            other_process_file.increment(metrics._key('hajni_courses_requests_total',
+                                                      {'status': '200', 'view': 'view_{}'.format(i)}))
+        other_process_file.increment(metrics._key('hajni_courses_requests_total', {'status': '200', 'view': 'home'}))
+        self.client.get(reverse('home'))
+        self.assertGreater(os.path.getsize(other_process_file.path), 64 * 1024)
+        reopened_file = metrics.MetricsFile(other_process_file.path)
+        reopened_file.increment(metrics._key('hajni_courses_requests_total', {'status': '200', 'view': 'view_2999'}))
+        values = metrics.collect()
+        self.assertEqual(values[metrics._key('hajni_courses_requests_total', {'status': '200', 'view': 'home'})], 2)
+        self.assertEqual(values[metrics._key('hajni_courses_requests_total',
+                                             {'status': '200', 'view': 'view_2999'})], 2)
+
+    def test_03_metrics_access(self):
+        """Tests that the metrics are available only for the staff users and with the token."""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code,
+                         404)
+        self.client.force_login(CustomUser.objects.create_user(username='staff', password='test_password',
+                                                               phone_number='0036301234567', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class SlowRequestProfilerTestCase(TestCase):
+    """
+    Test cases for profiling the slow requests.
+    """
+
+    def setUp(self):
+        profiling_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profiling_dir.cleanup)
+        self.profiling_dir = profiling_dir.name
+        self.enterContext(self.settings(PROFILING_SAMPLE_RATE=1, PROFILING_THRESHOLD=0, PROFILING_MAX_FILES=2,
+                                        PROFILING_DIR=self.profiling_dir))
+
+    def test_01_slow_requests_profiled(self):
+        """Tests that the reports of the slow requests are saved, keeping only the last PROFILING_MAX_FILES."""
+        self.client.force_login(CustomUser.objects.create_user(username='user', password='test_password',
+                                                               phone_number='0036301234567'))
+        for _ in range(2):
+            self.client.get(reverse('home'))
+        self.client.get(reverse('privacy_notice') + '?page=1')
+        reports = sorted(os.listdir(self.profiling_dir))
+        self.assertEqual(len(reports), 2)
+        with open(os.path.join(self.profiling_dir, reports[-1])) as report_file:
+            report = report_file.read()
+        self.assertIn('Request: GET /adatnyilatkozat?page=1\nView: privacy_notice\nUser: user\nStatus: 200\n',
+                      report)
+        self.assertIn('function calls', report)
+
+    def test_02_fast_requests_not_saved(self):
+        """Tests that no report is saved for the requests faster than the threshold or not sampled."""
+        with self.settings(PROFILING_THRESHOLD=60):
+            self.client.get(reverse('home'))
+        with self.settings(PROFILING_SAMPLE_RATE=0.5), patch('random.random', return_value=0.7):
+            self.client.get(reverse('home'))
+        self.assertEqual(os.listdir(self.profiling_dir), [])
+
+
+class QueryInspectorTestCase(TestCase):
+    """
+    Test cases for logging the slow queries and reporting the repeated ones.
+    """
+
+    @staticmethod
+    def _repeated_queries():
+        return [str(CustomUser.objects.filter(pk__in=range(i)).count()) for i in range(1, 6)]
+
+    def test_01_repeated_queries(self):
+        """Tests that the queries of the same shape are counted and reported with the stack in the app."""
+        query_inspector = QueryInspector()
+        with connection.execute_wrapper(query_inspector):
+            self._repeated_queries()
+            CustomUser.objects.exists()
+        repeated_queries = query_inspector.get_repeated_queries()
+        self.assertEqual(len(repeated_queries), 1)
+        self.assertRegex(repeated_queries[0], r'^5 times at tests/test_utils\.py:\d+ ')
+        self.assertIn('IN (...)', repeated_queries[0])
+
+    def test_02_repeated_queries_of_request(self):
+        """Tests that the repeated queries of a request fail the tests, or are logged in production."""
+        with patch.object(CustomUser, 'get_admin_emails', side_effect=self._repeated_queries):
+            with self.assertRaisesRegex(RepeatedQueryError, r'^Repeated queries \(N\+1\) in GET /:\n'
+                                                            r'5 times at .* < views\.py:\d+ get_context_data .*: SELECT'):
+                self.client.get(reverse('home'))
+            with self.settings(SQL_REPEATED_QUERY_RAISE=False), \
+                    patch('hajni_courses_app.utils.sql_inspection.logger') as logger:
+                self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertTrue(logger.warning.call_args[0][0].startswith('Repeated queries (N+1) in GET /'))
+        # the requests are not inspected while it is turned off
+        with self.settings(SQL_INSPECTION_ENABLED=False), \
+                patch.object(CustomUser, 'get_admin_emails', side_effect=self._repeated_queries):
+            self.client = self.client_class()
+            self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    def test_03_slow_query_logged(self):
+        """Tests that the queries slower than the threshold are logged with the stack in the app."""
+        with self.settings(SQL_SLOW_QUERY_THRESHOLD=0), \
+                patch('hajni_courses_app.utils.sql_inspection.logger') as logger, \
+                connection.execute_wrapper(QueryInspector()):
+            CustomUser.objects.exists()
+        self.assertRegex(logger.warning.call_args[0][0],
+                         r'^Slow query \(\d\.\d{3} s\) at tests/test_utils\.py:\d+ test_03_slow_query_logged: SELECT')
@@ -1,15 +1,21 @@
 import math
 import copy
+import hashlib
+import io
 import os
 import re
+import tempfile
+import zipfile
 from rest_framework import status
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase, Client
 from django.urls import reverse
 from unittest.mock import patch
 
 from hajni_courses import settings
-from hajni_courses_app.models import CustomUser, Course
-from hajni_courses_app.utils.constants import COURSES_PER_PAGE, PAGINATION_PAGES
+from hajni_courses_app.models import CustomUser, Course, UserSession, DownloadableFile
+from hajni_courses_app.utils.constants import COURSES_PER_PAGE, PAGINATION_PAGES, DOWNLOADS_ZIP_CHUNK_SIZE
 
 
 class BaseViewTestCase(TestCase):
@@ -341,6 +347,7 @@ class DeleteProfileTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_302_FOUND)
         self.assertRedirects(response, reverse('home'))
         self.assertEqual(CustomUser.objects.count(), 0)
+        self.assertFalse(UserSession.objects.exists())
 
 
 class CourseViewTestCase(TestCase):
@@ -358,9 +365,12 @@ class CourseViewTestCase(TestCase):
             'for_non_pensioners': True,
             'active': True
         }
-        return Course.objects.create(**course_attrs)
+        # the course lists are invalidated after the commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return Course.objects.create(**course_attrs)
 
     def setUp(self):
+        cache.clear()
         self.course = self._create_course()
 
     def _login(self):
@@ -598,6 +608,81 @@ class CourseViewTestCase(TestCase):
             PAGINATION_PAGES + 2))
         self.assertContains(response, '<a class="page_link" href="?page=1">&laquo; első</a>')
 
+    def test_13_invalid_page_number(self):
+        """Tests that an invalid page number shows the first page instead of failing."""
+        for page in ('abc', '-1', '0', ''):
+            response = self.client.get(reverse('general_courses'), {'page': page})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, '<div class="course_box">')
+
+    def test_14_keyset_pagination(self):
+        """Tests that the pages are fetched by course id, and the page index is cached until a course changes."""
+        courses = [self.course] + [self._create_course(str(i + 1)) for i in range(COURSES_PER_PAGE)]
+        self.client.get(reverse('pensioner_courses'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('pensioner_courses'), {'page': 2})
+        self.assertEqual(list(response.context['courses']), courses[COURSES_PER_PAGE:])
+        response = self.client.get(reverse('pensioner_courses'), {'after': courses[0].id})
+        self.assertEqual(list(response.context['courses']), courses[1:COURSES_PER_PAGE + 1])
+        # a new course invalidates the cached page index
+        self._create_course('new')
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('pensioner_courses'), {'page': 2})
+        self.assertEqual(len(response.context['courses']), 2)
+
+    def test_15_rendered_course_list_is_cached(self):
+        """Tests that a rendered course list page is served from the cache until a course changes."""
+        self.client.get(reverse('general_courses'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('general_courses'))
+        self.assertContains(response, 'course_name')
+        self.course.name = 'renamed_course'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+            # the lists are invalidated only after the commit
+            self.assertNotContains(self.client.get(reverse('general_courses')), 'RENAMED_COURSE')
+        response = self.client.get(reverse('general_courses'))
+        self.assertContains(response, 'RENAMED_COURSE')
+
+    def test_16_course_conditional_get(self):
+        """Tests that an unchanged course page is answered with 304 using a single query, a changed one with 200."""
+        response = self.client.get(reverse('course', args=(self.course.slug,)))
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('course', args=(self.course.slug,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.course.save()
+        response = self.client.get(reverse('course', args=(self.course.slug,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the page is different for a logged-in user
+        etag = response['ETag']
+        self._login()
+        response = self.client.get(reverse('course', args=(self.course.slug,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_17_course_list_conditional_get(self):
+        """Tests that an unchanged course list page is answered with 304 without querying the database."""
+        response = self.client.get(reverse('pensioner_courses'))
+        etag = response['ETag']
+        # the lists are validated only by their ETag
+        self.assertFalse(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('pensioner_courses'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # another page of the list has a different ETag
+        response = self.client.get(reverse('pensioner_courses'), {'page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self._create_course('new')
+        response = self.client.get(reverse('pensioner_courses'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # so does a deleted course
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.get(name='course_namenew').delete()
+        response = self.client.get(reverse('pensioner_courses'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 
 class ApplyViewTestCase(TestCase):
     """
@@ -695,6 +780,19 @@ class DownloadsTestCase(TestCase):
     Test cases for the Downloads view.
     """
 
+    def setUp(self):
+        """Imports the files of the repository into a temporary media root."""
+        cache.clear()
+        self.files_path = os.path.join(settings.MEDIA_ROOT, 'files')
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_downloads', self.files_path, stdout=io.StringIO())
+        self.group = 'Gépírás'
+        self.content = self._read_file('Program.zip')
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
     def _login(self):
         """Logs in a normal user."""
         self.client = Client()
@@ -702,6 +800,13 @@ class DownloadsTestCase(TestCase):
                                                    phone_number='0036301234567')
         self.client.force_login(user=self.user)
 
+    def _read_file(self, file_name):
+        with open(os.path.join(self.files_path, 'gépírás', file_name), 'rb') as file:
+            return file.read()
+
+    def _file_url(self):
+        return reverse('download_file', args=[self.sha256, 'Program.zip'])
+
     def test_01_downloads_rendering(self):
         """Tests that the downloads view is rendered successfully and the correct template is used."""
         response = self.client.get(reverse('downloads'))
@@ -712,17 +817,14 @@ class DownloadsTestCase(TestCase):
         """Tests that the downloads view is rendered successfully and the file groups and filenames are displayed."""
         response = self.client.get(reverse('downloads'))
         html_content = response.content.decode('utf-8')
-
-        base_path = os.path.join(settings.MEDIA_ROOT, "files")
-        if os.path.exists(base_path):
-            for folder_name in os.listdir(base_path):
-                pattern = '<h3>{}</h3>'.format(folder_name.replace('_', ' ').title())
-                match = re.search(pattern, html_content, re.DOTALL | re.IGNORECASE)
-                self.assertIsNotNone(match)
-                for filename in os.listdir(os.path.join(base_path, folder_name)):
-                    pattern = '<td class="file_name">{}</td>'.format(filename)
-                    match = re.search(pattern, html_content, re.DOTALL | re.IGNORECASE)
-                    self.assertIsNotNone(match)
+        self.assertTrue(DownloadableFile.objects.exists())
+        for downloadable_file in DownloadableFile.objects.all():
+            pattern = '<h3>{}</h3>'.format(downloadable_file.group)
+            match = re.search(pattern, html_content, re.DOTALL | re.IGNORECASE)
+            self.assertIsNotNone(match)
+            pattern = '<td class="file_name">{}</td>'.format(downloadable_file.name)
+            match = re.search(pattern, html_content, re.DOTALL | re.IGNORECASE)
+            self.assertIsNotNone(match)
 
     def test_03_download_is_disabled_when_not_logged_in(self):
         """Tests that the download option is not available for users not logged in."""
@@ -743,3 +845,108 @@ class DownloadsTestCase(TestCase):
         pattern = r'<a class="a_button green_button(.*)Letöltés(.*)</a>'
         match = re.search(pattern, html_content, re.DOTALL | re.IGNORECASE)
         self.assertIsNotNone(match)
+        self.assertIn('href="{}"'.format(self._file_url()), html_content)
+
+    def test_05_download_file_requires_login(self):
+        """Tests that the users not logged in are redirected to the login page when downloading a file."""
+        response = self.client.get(self._file_url())
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertTrue(response.url.startswith(reverse('login')))
+
+    def test_06_download_file(self):
+        """Tests that the file is sent as an attachment to the users logged in, cacheable forever."""
+        self._login()
+        response = self.client.get(self._file_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Program.zip"')
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'private', 'max-age=31536000', 'immutable'})
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_07_download_unknown_file(self):
+        """Tests that only the files listed on the downloads page can be downloaded."""
+        self._login()
+        for sha256, file_name in ((self.sha256, 'missing.pdf'), ('0' * 64, 'Program.zip'), ('..', 'settings.py')):
+            response = self.client.get(reverse('download_file', args=[sha256, file_name]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_08_download_file_with_front_end_server(self):
+        """Tests that the transfer is handed over to nginx or apache when configured."""
+        self._login()
+        blob_path = 'blobs/{}/{}.zip'.format(self.sha256[:2], self.sha256)
+        with self.settings(DOWNLOADS_SENDFILE_BACKEND='nginx'):
+            response = self.client.get(self._file_url())
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + blob_path)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Program.zip"')
+        self.assertEqual(response.content, b'')
+        with self.settings(DOWNLOADS_SENDFILE_BACKEND='apache'):
+            response = self.client.get(self._file_url())
+        self.assertTrue(response['X-Sendfile'].endswith('/' + blob_path))
+        self.assertEqual(response.content, b'')
+
+    def test_09_download_file_range(self):
+        """Tests that a single byte range is sent as partial content."""
+        self._login()
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/{}'.format(len(self.content)))
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['ETag'], '"{}"'.format(self.sha256))
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes=-10'})
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+    def test_10_download_file_multiple_ranges(self):
+        """Tests that more byte ranges are sent as multipart/byteranges, merging the overlapping ones."""
+        self._login()
+        content = self.content
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes=500-599, 0-9, 5-19'})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn('Content-Range: bytes 0-19/{}\r\n\r\n'.format(len(content)).encode() + content[:20], body)
+        self.assertIn('Content-Range: bytes 500-599/{}\r\n\r\n'.format(len(content)).encode() + content[500:600], body)
+
+    def test_11_download_file_unsatisfiable_range(self):
+        """Tests that a range after the end of the file is answered with 416."""
+        self._login()
+        size = len(self.content)
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes={}-'.format(size)})
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */{}'.format(size))
+
+    def test_12_download_file_if_range(self):
+        """Tests that the range is sent only if the If-Range header matches the current ETag."""
+        self._login()
+        etag = '"{}"'.format(self.sha256)
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        response = self.client.get(self._file_url(), headers={'Range': 'bytes=0-9', 'If-Range': '"outdated"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response = self.client.get(self._file_url(), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_13_download_group_requires_login(self):
+        """Tests that the users not logged in are redirected to the login page when downloading a group."""
+        response = self.client.get(reverse('download_group', args=[self.group]))
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self._login()
+        response = self.client.get(reverse('download_group', args=['missing']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_14_download_group(self):
+        """Tests that the files of a group are streamed in a ZIP archive in small chunks."""
+        self._login()
+        response = self.client.get(reverse('download_group', args=[self.group]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=utf-8''G%C3%A9p%C3%ADr%C3%A1s.zip")
+        chunks = list(response.streaming_content)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), DOWNLOADS_ZIP_CHUNK_SIZE + 1024)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(sorted(archive.namelist()), sorted(os.listdir(os.path.join(self.files_path, 'gépírás'))))
+            for info in archive.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(archive.read(info), self._read_file(info.filename))
@@ -1,5 +1,3 @@
-from django.conf.urls.static import static
-from django.conf import settings
 from django.urls import path, include
 
 from . import views
@@ -20,4 +18,7 @@ urlpatterns = [
     path('kepzes/<slug:slug>/jelentkezes', views.apply, name='apply'),
     path('adatnyilatkozat', views.PrivacyNoticePage.as_view(), name='privacy_notice'),
     path('letoltesek', views.downloads_view, name='downloads'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('letoltesek/<str:group_name>', views.download_group, name='download_group'),
+    path('letoltesek/<str:sha256>/<str:file_name>', views.download_file, name='download_file'),
+    path('metrics', views.metrics_view, name='metrics'),
+]
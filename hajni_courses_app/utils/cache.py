@@ -0,0 +1,78 @@
+import fcntl
+import hashlib
+import os
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+from hajni_courses_app.utils.constants import CACHE_LOCK_WAIT, CACHE_LOCK_POLL_INTERVAL
+
+
+def get_version(version_key: str):
+    """
+    Returns the current version stored under the version key, creating it if it is missing.
+    """
+    version = cache.get(version_key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(version_key, version, None):
+            version = cache.get(version_key, version)
+    return version
+
+
+def bump_version(version_key: str):
+    """
+    Outdates every value cached with get_or_render for the version key.
+    """
+    cache.set(version_key, time.time_ns(), None)
+
+
+def try_lock(key: str):
+    """
+    Locks the lock file of the key in CACHE_LOCK_DIR, and returns the open lock file, closing it releases the lock.
+    Returns None if another process (or thread) holds the lock. The lock is released by the system when its process
+    dies, so it can not be left locked. The cache entries are locked with a file, as cache.add is not atomic on the
+    file based cache.
+    """
+    os.makedirs(settings.CACHE_LOCK_DIR, exist_ok=True)
+    path = os.path.join(settings.CACHE_LOCK_DIR, '{}.lock'.format(hashlib.md5(key.encode()).hexdigest()))
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def get_or_render(key: str, version_key: str, render, timeout: int):
+    """
+    Returns the value cached under the key if it was rendered for the current version, otherwise renders and caches it.
+    Only one process of the host renders a missing or outdated value at a time. Meanwhile, the others are served the outdated
+    value, or wait for the new one if there is none, so a cold entry does not make every request hit the database.
+    """
+    cached = cache.get_many([key, version_key])
+    version = cached.get(version_key)
+    if version is None:
+        version = get_version(version_key)
+    entry = cached.get(key)
+    if entry is not None and entry['version'] == version:
+        return entry['value']
+
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while True:
+        lock_file = try_lock(key)
+        if lock_file is not None:
+            with lock_file:
+                value = render()
+                cache.set(key, {'version': version, 'value': value}, timeout)
+            return value
+        if entry is not None:
+            return entry['value']
+        if time.monotonic() >= deadline:
+            # the process holding the lock is too slow, rendering without caching
+            return render()
+        time.sleep(CACHE_LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry['version'] == version:
+            return entry['value']
@@ -0,0 +1,78 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from django.utils.translation import get_language
+
+from hajni_courses_app.models import Course
+from hajni_courses_app.utils.cache import get_version
+from hajni_courses_app.utils.constants import COURSE_LIST_VERSION_CACHE_KEY
+from hajni_courses_app.utils.downloads import get_file
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+_templates_version = None
+
+
+def get_templates_version() -> str:
+    """
+    Returns a fingerprint of the templates, so that a deployment changing them changes the ETags too.
+    It is computed once per process.
+    """
+    global _templates_version
+    if _templates_version is None:
+        fingerprint = hashlib.md5(usedforsecurity=False)
+        for root, _dirs, files in sorted(os.walk(TEMPLATES_DIR)):
+            for file_name in sorted(files):
+                stat = os.stat(os.path.join(root, file_name))
+                fingerprint.update('{}:{}:{};'.format(file_name, stat.st_size, stat.st_mtime_ns).encode())
+        _templates_version = fingerprint.hexdigest()
+    return _templates_version
+
+
+def make_etag(request, *parts) -> str:
+    """
+    Returns an ETag of the given content version parts for the current user, as the pages are rendered differently
+    for them.
+    """
+    user = request.user
+    user_key = '{}:{}:{}'.format(user.pk, user.username, user.is_staff) if user.is_authenticated else 'anonymous'
+    etag = hashlib.md5(usedforsecurity=False)
+    for part in (get_templates_version(), get_language(), user_key) + parts:
+        etag.update('{};'.format(part).encode())
+    return etag.hexdigest()
+
+
+def _get_course_updated_at(request, slug: str) -> datetime | None:
+    """
+    Returns the modification time of the course, looking it up only once per request.
+    """
+    if not hasattr(request, '_course_updated_at'):
+        request._course_updated_at = Course.objects.filter(slug=slug).values_list('updated_at', flat=True).first()
+    return request._course_updated_at
+
+
+def course_etag(request, slug: str) -> str | None:
+    updated_at = _get_course_updated_at(request, slug)
+    if updated_at is None:
+        return None
+    # the back button of the course page links to the referer
+    return make_etag(request, slug, updated_at.isoformat(), request.META.get('HTTP_REFERER', '/'))
+
+
+def course_last_modified(request, slug: str) -> datetime | None:
+    return _get_course_updated_at(request, slug)
+
+
+def course_list_etag(request) -> str:
+    return make_etag(request, request.path, request.GET.urlencode(), get_version(COURSE_LIST_VERSION_CACHE_KEY))
+
+
+def download_etag(request, sha256: str, file_name: str) -> str | None:
+    # strong ETag, the content hash of the file
+    return sha256 if get_file(sha256, file_name) else None
+
+
+def download_last_modified(request, sha256: str, file_name: str) -> datetime | None:
+    file = get_file(sha256, file_name)
+    return datetime.fromtimestamp(file['updated_at'], tz=timezone.utc) if file else None
@@ -10,9 +10,65 @@ PHONE_NUMBER_VALIDATOR = r'^$|(?:0036|\+36|06)[0-9]{1,10}$'
 PAGINATION_PAGES = 5  # should be an odd number
 COURSES_PER_PAGE = 12
 
+# cache constants
+ADMIN_EMAILS_CACHE_KEY = 'admin_emails'
+ADMIN_EMAILS_CACHE_TIMEOUT = 60 * 60  # seconds, the cache is also invalidated when a user is saved or deleted
+COURSE_LIST_CACHE_KEY = 'course_list_page_index_{}'  # formatted with the audience
+COURSE_LIST_FRAGMENT_CACHE_KEY = 'course_list_{}_{}_{}'  # formatted with the audience, the language and the page
+COURSE_LIST_VERSION_CACHE_KEY = 'course_list_version'
+COURSE_LIST_CACHE_TIMEOUT = 60 * 60  # seconds, the cache is also invalidated when a course is saved or deleted
+DOWNLOADS_MANIFEST_CACHE_KEY = 'downloads_manifest'
+DOWNLOADS_BLOB_DIRECTORY = 'blobs'  # folder of MEDIA_ROOT storing the downloadable files under their hash
+DOWNLOADS_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # seconds, the URL of a downloadable file changes with its content
+DOWNLOADS_MAX_RANGES = 16  # byte ranges served in one response, more of them get the whole file
+DOWNLOADS_ZIP_CHUNK_SIZE = 64 * 1024  # bytes read from a file at a time when streaming a ZIP archive
+# files already compressed, they are stored in the ZIP archives without compressing them again
+DOWNLOADS_ZIP_STORED_EXTENSIONS = ('.zip', '.gz', '.rar', '.7z', '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp',
+                                   '.mp3', '.mp4', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub')
+CACHE_LOCK_WAIT = 5  # seconds to wait for another process regenerating a cache entry
+CACHE_LOCK_POLL_INTERVAL = 0.05  # seconds
+
+# metrics constants
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+METRICS_DB_QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+METRICS_RESPONSE_SIZE_BUCKETS = (1000, 10000, 50000, 100000, 500000, 1000000, 10000000)  # bytes
+METRICS_FILE_INITIAL_SIZE = 64 * 1024  # bytes, the file is doubled when it is full
+PROFILING_REPORT_LINES = 60  # functions listed in the report of a slow request, by cumulative time
+SQL_LOGGED_LENGTH = 500  # characters of a slow or repeated query logged
+SQL_STACK_DEPTH = 5  # frames of the app logged with a slow or repeated query
+
+# static files constants
+STATIC_FILES_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # seconds, the hashed name of a static file changes with its content
+STATIC_FILES_UNHASHED_CACHE_MAX_AGE = 60 * 60  # seconds
+STATIC_FILES_COMPRESSED_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html')
+# images of the static files resized by the generate_responsive_images command
+RESPONSIVE_IMAGES = ('hajni_image.jpeg', 'general_courses_image.png', 'pensioner_courses_image.png',
+                     'logo_with_text.jpeg')
+RESPONSIVE_IMAGE_WIDTHS = (240, 480, 720)  # pixels, the images are displayed 250 pixels wide at most
+RESPONSIVE_IMAGE_QUALITY = {'avif': 55, 'webp': 80}  # the formats in the order of preference
+RESPONSIVE_IMAGE_DIRECTORY = 'responsive'  # folder of the static files with the resized images and their manifest
+
+# pruning constants
+PRUNE_BATCH_SIZE = 500  # rows deleted in one transaction
+PRUNE_BATCH_PAUSE = 0.1  # seconds between two batches, so the live traffic is not slowed down
+UNACTIVATED_ACCOUNT_MAX_AGE = 7  # days an account can wait for its activation before it is deleted
+SENT_EMAIL_MAX_AGE = 30  # days a sent email is kept in the email outbox
+
+# email outbox constants
+EMAIL_OUTBOX_BATCH_SIZE = 20  # emails claimed by a worker in one transaction
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+# seconds the emails claimed by a worker are postponed for, they are sent again if the worker stops before finishing
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 5 * 60
+EMAIL_OUTBOX_RETRY_BASE_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_OUTBOX_RETRY_MAX_DELAY = 3600  # seconds
+EMAIL_OUTBOX_POLL_INTERVAL = 5  # seconds the worker sleeps when there is nothing to send
+EMAIL_ADMIN_DIGEST_WINDOW = 300  # seconds the admin notifications are collected for before sending them as one email
+EMAIL_ADMIN_DIGEST_MAX_SIZE = 100  # notifications in one digest email
+
 # Email templates
 USER_CANCELLATION_EMAIL_SUBJECT = str(_('Deaktiváltuk a fiókodat'))
 USER_REGISTRATION_EMAIL_SUBJECT = str(_('Erősítsd meg a regisztrációdat a Képzés Mindenkinek! oldalán'))
 CALLBACK_EMAIL_SUBJECT = str(_('Valaki visszahívást kért'))
 APPLICATION_EMAIL_SUBJECT = str(_('Valaki jelentkezett egy tanfolyamodra'))
 APPLICATION_CONFIRMATION_SUBJECT = str(_('Jelentkezés megerősítése'))
+ADMIN_DIGEST_EMAIL_SUBJECT = str(_('Új értesítések összesítője'))
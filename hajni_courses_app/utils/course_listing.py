@@ -0,0 +1,122 @@
+from bisect import bisect_right
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils.translation import get_language
+
+from hajni_courses_app.models import Course
+from hajni_courses_app.utils.cache import get_or_render, bump_version
+from hajni_courses_app.utils.constants import COURSES_PER_PAGE, PAGINATION_PAGES, COURSE_LIST_CACHE_KEY, \
+    COURSE_LIST_FRAGMENT_CACHE_KEY, COURSE_LIST_VERSION_CACHE_KEY, COURSE_LIST_CACHE_TIMEOUT
+
+
+def _to_int(value) -> int | None:
+    """Returns the value as an integer or None if it is not a valid one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CourseListingPage:
+    """
+    One page of a course listing with the page numbers to display around it.
+    """
+
+    def __init__(self, number: int, num_pages: int, object_list):
+        self.number: int = number
+        self.num_pages: int = num_pages
+        self.object_list = object_list
+
+    @property
+    def has_previous(self) -> bool:
+        return self.number > 1
+
+    @property
+    def has_next(self) -> bool:
+        return self.number < self.num_pages
+
+    @property
+    def page_window(self) -> list[int]:
+        """
+        Returns the PAGINATION_PAGES page numbers to link, keeping the current page in the middle when possible.
+        """
+        pages_before_after = int(PAGINATION_PAGES / 2)
+        if self.num_pages <= PAGINATION_PAGES:
+            return list(range(1, self.num_pages + 1))
+        if self.num_pages - self.number < pages_before_after:
+            return list(range(self.num_pages - PAGINATION_PAGES + 1, self.num_pages + 1))
+        if self.number - pages_before_after <= 0:
+            return list(range(1, PAGINATION_PAGES + 1))
+        return list(range(self.number - pages_before_after, self.number + pages_before_after + 1))
+
+
+class CourseListing:
+    """
+    Keyset paginated listing of the courses of an audience, ordered by id. Only the card fields of the courses are
+    fetched.
+    The id of the first course of every page and the total count are cached per audience until a course changes,
+    so a page is fetched with an indexed `id >= first_id` query instead of COUNT(*) and OFFSET.
+    The page indexes and the rendered pages (see render_page) are cached for the version of the course lists, so
+    they are all outdated together.
+    """
+
+    def __init__(self, audience: str, course_filter: Q, per_page: int = COURSES_PER_PAGE):
+        self.audience: str = audience
+        self.course_filter: Q = course_filter
+        self.per_page: int = per_page
+
+    @staticmethod
+    def invalidate():
+        """
+        Outdates the cached page indexes and rendered pages of every audience. Called after the commit of a course
+        change, so that the old courses are not cached again for the new version.
+        """
+        bump_version(COURSE_LIST_VERSION_CACHE_KEY)
+
+    def get_courses(self):
+        return Course.objects.filter(self.course_filter).order_by('id')
+
+    def get_page_index(self) -> dict:
+        """
+        Returns the total count and the id of the first course of every page.
+        """
+        def render():
+            course_ids = list(self.get_courses().values_list('id', flat=True))
+            return {'count': len(course_ids), 'first_ids': course_ids[::self.per_page]}
+
+        return get_or_render(COURSE_LIST_CACHE_KEY.format(self.audience), COURSE_LIST_VERSION_CACHE_KEY, render,
+                             COURSE_LIST_CACHE_TIMEOUT)
+
+    def get_page(self, page_number=None, after=None) -> CourseListingPage:
+        """
+        Returns the requested page. `after` continues the listing after the given course id, otherwise the page
+        number is used. An invalid page number gives the first page, a too large one the last page.
+        """
+        first_ids = self.get_page_index()['first_ids']
+        num_pages = max(len(first_ids), 1)
+        after = _to_int(after)
+        if after is not None:
+            number = min(bisect_right(first_ids, after) + 1, num_pages)
+            courses = self.get_courses().only(*Course.CARD_FIELDS).filter(id__gt=after)[:self.per_page]
+            return CourseListingPage(number, num_pages, courses)
+        number = min(max(_to_int(page_number) or 1, 1), num_pages)
+        if not first_ids:
+            return CourseListingPage(number, num_pages, Course.objects.none())
+        courses = self.get_courses().only(*Course.CARD_FIELDS).filter(id__gte=first_ids[number - 1])[:self.per_page]
+        return CourseListingPage(number, num_pages, courses)
+
+    def render_page(self, page_number=None, after=None) -> str:
+        """
+        Returns the course boxes and the pagination of the requested page rendered. The pages requested by number
+        are cached per audience, language and page until a course changes, with only one process regenerating
+        an outdated page at a time.
+        """
+        def render():
+            page = self.get_page(page_number, after)
+            return render_to_string('course_list.html', {'page': page, 'courses': page.object_list,
+                                                         'pages': page.page_window})
+
+        if _to_int(after) is not None:
+            return render()
+        key = COURSE_LIST_FRAGMENT_CACHE_KEY.format(self.audience, get_language(), max(_to_int(page_number) or 1, 1))
+        return get_or_render(key, COURSE_LIST_VERSION_CACHE_KEY, render, COURSE_LIST_CACHE_TIMEOUT)
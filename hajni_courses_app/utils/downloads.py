@@ -0,0 +1,285 @@
+import mimetypes
+import os
+import re
+import secrets
+import zipfile
+from datetime import datetime
+from urllib.parse import quote
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import content_disposition_header, parse_http_date_safe
+
+from hajni_courses_app.models import DownloadableFile
+from hajni_courses_app.utils.constants import DOWNLOADS_MANIFEST_CACHE_KEY, DOWNLOADS_MAX_RANGES, \
+    DOWNLOADS_ZIP_CHUNK_SIZE, DOWNLOADS_ZIP_STORED_EXTENSIONS, DOWNLOADS_CACHE_MAX_AGE
+
+
+def build_manifest() -> dict:
+    """
+    Returns the downloadable files grouped, with their size, modification time, SHA-256 hash and path in
+    MEDIA_ROOT.
+    """
+    file_groups = []
+    for downloadable_file in DownloadableFile.objects.all():
+        if not file_groups or file_groups[-1]['name'] != downloadable_file.group:
+            file_groups.append({'name': downloadable_file.group, 'files': []})
+        file_groups[-1]['files'].append({'name': downloadable_file.name,
+                                         'size': downloadable_file.size,
+                                         'updated_at': int(downloadable_file.updated_at.timestamp()),
+                                         'sha256': downloadable_file.sha256,
+                                         'path': downloadable_file.path})
+    return {'file_groups': file_groups}
+
+
+def get_manifest() -> dict:
+    """
+    Returns the manifest of the downloads, built once and shared with the other processes through the cache until
+    a downloadable file changes.
+    """
+    manifest = cache.get(DOWNLOADS_MANIFEST_CACHE_KEY)
+    if manifest is None:
+        manifest = build_manifest()
+        cache.set(DOWNLOADS_MANIFEST_CACHE_KEY, manifest, None)
+    return manifest
+
+
+def invalidate_manifest():
+    cache.delete(DOWNLOADS_MANIFEST_CACHE_KEY)
+
+
+def get_group(group_name: str) -> dict | None:
+    """
+    Returns the manifest entry of the given file group or None if there is no such group.
+    """
+    return next((group for group in get_manifest()['file_groups'] if group['name'] == group_name), None)
+
+
+def get_file(sha256: str, file_name: str) -> dict | None:
+    """
+    Returns the manifest entry of the file with the given hash and name or None if it is not a downloadable file.
+    Only the files of the manifest can be downloaded, so no path can point outside the downloads storage.
+    """
+    return next((file for group in get_manifest()['file_groups'] for file in group['files']
+                 if file['sha256'] == sha256 and file['name'] == file_name), None)
+
+
+class FileRange:
+    """
+    Reads a byte range of an open file. FileResponse streams it with read(), and the WSGI servers supporting
+    wsgi.file_wrapper send it with os.sendfile from the current position of the file through fileno(), limited by
+    the Content-Length of the response.
+    """
+
+    def __init__(self, file, start: int, length: int):
+        file.seek(start)
+        self.file = file
+        self.remaining: int = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_ranges(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Returns the satisfiable byte ranges of a Range header as (first, last) positions, sorted and with the
+    overlapping and adjacent ranges merged. Returns None if the header is invalid or has more than
+    DOWNLOADS_MAX_RANGES ranges, so that the whole file is sent, and an empty list if no range is satisfiable.
+    """
+    unit, _equal_sign, range_set = header.partition('=')
+    specs = [spec.strip() for spec in range_set.split(',') if spec.strip()]
+    if unit.strip().lower() != 'bytes' or not specs or len(specs) > DOWNLOADS_MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = re.fullmatch(r'(\d*)\s*-\s*(\d*)', spec, re.ASCII)
+        if match is None or match.group(1) == match.group(2) == '':
+            return None
+        if match.group(1) == '':
+            # suffix range, the last N bytes
+            suffix_length = int(match.group(2))
+            if suffix_length > 0 and size > 0:
+                ranges.append((max(size - suffix_length, 0), size - 1))
+            continue
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else None
+        if last is not None and last < first:
+            return None
+        if first < size:
+            ranges.append((first, size - 1 if last is None else min(last, size - 1)))
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _if_range_matches(request, file: dict) -> bool:
+    """
+    Returns whether the ranges can be sent: there is no If-Range header or it matches the strong ETag or the
+    modification time of the file.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == '"{}"'.format(file['sha256'])
+    return parse_http_date_safe(if_range) == file['updated_at']
+
+
+def _range_response(file_object, file: dict, ranges: list[tuple[int, int]], size: int):
+    """
+    Returns the 206 Partial Content response of the ranges of the open file. A single range is sent with a
+    FileResponse, so it can be sent with os.sendfile too, more ranges as multipart/byteranges.
+    """
+    content_type = mimetypes.guess_type(file['name'])[0] or 'application/octet-stream'
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        response = FileResponse(FileRange(file_object, first, last - first + 1), status=206, as_attachment=True,
+                                filename=file['name'], content_type=content_type)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+        return response
+
+    boundary = secrets.token_hex(16)
+    part_headers = ['\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'.format(
+        boundary, content_type, first, last, size).encode() for first, last in ranges]
+    closing = '\r\n--{}--\r\n'.format(boundary).encode()
+
+    def stream_parts():
+        try:
+            for (first, last), part_header in zip(ranges, part_headers):
+                yield part_header
+                file_range = FileRange(file_object, first, last - first + 1)
+                yield from iter(lambda: file_range.read(FileResponse.block_size), b'')
+            yield closing
+        finally:
+            file_object.close()
+
+    response = StreamingHttpResponse(stream_parts(), status=206,
+                                     content_type='multipart/byteranges; boundary={}'.format(boundary))
+    response['Content-Length'] = (sum(len(part_header) for part_header in part_headers) + len(closing)
+                                  + sum(last - first + 1 for first, last in ranges))
+    response['Content-Disposition'] = content_disposition_header(True, file['name'])
+    return response
+
+
+def file_response(request, file: dict) -> HttpResponse | StreamingHttpResponse:
+    """
+    Returns the response sending the file as an attachment.
+    With DOWNLOADS_SENDFILE_BACKEND set, the response is empty and the front-end server sends the file itself
+    ('nginx': X-Accel-Redirect to the internal DOWNLOADS_ACCEL_REDIRECT_PREFIX location, 'apache': X-Sendfile),
+    handling the Range requests too.
+    Otherwise the file is streamed by a FileResponse, which the WSGI server sends with os.sendfile through
+    wsgi.file_wrapper when it supports it (e.g. gunicorn). The Range and If-Range headers are supported, so an
+    interrupted download can be resumed. Raises FileNotFoundError if the file was removed.
+    As the URL of a file contains the hash of its content, the browsers can cache it forever.
+    """
+    backend = settings.DOWNLOADS_SENDFILE_BACKEND
+    if backend in ('nginx', 'apache'):
+        response = HttpResponse()
+        if backend == 'nginx':
+            response['X-Accel-Redirect'] = quote(settings.DOWNLOADS_ACCEL_REDIRECT_PREFIX + file['path'])
+        else:
+            response['X-Sendfile'] = quote(os.path.join(settings.MEDIA_ROOT, file['path']))
+        response['Content-Type'] = mimetypes.guess_type(file['name'])[0] or 'application/octet-stream'
+        response['Content-Disposition'] = content_disposition_header(True, file['name'])
+    else:
+        response = _django_file_response(request, os.path.join(settings.MEDIA_ROOT, file['path']), file)
+    if response.status_code != 416:
+        patch_cache_control(response, max_age=DOWNLOADS_CACHE_MAX_AGE, immutable=True)
+    return _private(response)
+
+
+def _django_file_response(request, file_path: str, file: dict) -> HttpResponse | StreamingHttpResponse:
+    file_object = open(file_path, 'rb')
+    size = os.fstat(file_object.fileno()).st_size
+    ranges = None
+    if 'HTTP_RANGE' in request.META and _if_range_matches(request, file):
+        ranges = parse_ranges(request.META['HTTP_RANGE'], size)
+    if ranges == []:
+        file_object.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+    elif ranges:
+        response = _range_response(file_object, file, ranges, size)
+    else:
+        response = FileResponse(file_object, as_attachment=True, filename=file['name'])
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+class _ZipStream:
+    """
+    Write-only file collecting the output of ZipFile until it is taken by the response. ZipFile writes data
+    descriptors after the files as this file is not seekable, so the archive is never held in memory.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_zip(group: dict):
+    """
+    Yields a ZIP archive of the files of the group, built while it is sent, so the memory used does not depend on
+    the size of the group. The files already compressed are stored, the others are deflated.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for file in group['files']:
+            modified_at = datetime.fromtimestamp(file['updated_at'])
+            info = zipfile.ZipInfo(file['name'], date_time=modified_at.timetuple()[:6])
+            info.file_size = file['size']
+            stored = os.path.splitext(file['name'])[1].lower() in DOWNLOADS_ZIP_STORED_EXTENSIONS
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(os.path.join(settings.MEDIA_ROOT, file['path']), 'rb') as source, \
+                    archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(DOWNLOADS_ZIP_CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    if stream.buffer:
+                        yield stream.take()
+            yield stream.take()
+    # the central directory
+    yield stream.take()
+
+
+def zip_response(group: dict) -> StreamingHttpResponse:
+    """
+    Returns the response streaming the ZIP archive of the files of the group.
+    """
+    response = StreamingHttpResponse(stream_zip(group), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, '{}.zip'.format(group['name']))
+    # nginx would buffer the archive to a temporary file
+    response['X-Accel-Buffering'] = 'no'
+    return _private(response)
+
+
+def _private(response):
+    # the files are available only for the users logged in
+    patch_cache_control(response, private=True)
+    return response
@@ -0,0 +1,185 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from django.conf import settings
+
+from hajni_courses_app.utils.constants import METRICS_DB_QUERIES_BUCKETS, METRICS_DURATION_BUCKETS, \
+    METRICS_FILE_INITIAL_SIZE, METRICS_RESPONSE_SIZE_BUCKETS
+
+
+# name -> (type, help) of the metrics, in the order of the /metrics endpoint
+METRICS = {
+    'hajni_courses_requests_total': ('counter', 'Requests per view and status code.'),
+    'hajni_courses_request_duration_seconds': ('histogram', 'Time spent in Django per view.'),
+    'hajni_courses_request_db_queries': ('histogram', 'SQL queries of a request per view.'),
+    'hajni_courses_request_db_duration_seconds': ('counter', 'Time spent in SQL queries per view.'),
+    'hajni_courses_response_size_bytes': ('histogram', 'Size of the responses per view.'),
+}
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+class MetricsFile:
+    """
+    Values of the metrics of a process in a memory-mapped file, so a process updates them without a system call,
+    and the /metrics endpoint of any process can read and sum the files of every worker process.
+    The file starts with the used size, followed by the entries: the length of the key, the key padded to 8 bytes and
+    the value (double). An entry is complete before the used size includes it, so the file can be read anytime.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        if self._capacity == 0:
+            self._capacity = METRICS_FILE_INITIAL_SIZE
+            self._file.truncate(self._capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('i', self._mmap, 0)[0] or 8
+        self._positions = {key: position for key, _value, position in read_entries(self._mmap)}
+
+    def increment(self, key: str, amount: float = 1):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._add(key)
+            struct.pack_into('d', self._mmap, position, struct.unpack_from('d', self._mmap, position)[0] + amount)
+
+    def _add(self, key: str) -> int:
+        """
+        Appends the entry of a new key and returns the position of its value.
+        """
+        encoded = key.encode()
+        position = self._used + 4 + len(encoded)
+        position += -position % 8
+        while position + 8 > self._capacity:
+            self._capacity *= 2
+            self._mmap.close()
+            self._file.truncate(self._capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        struct.pack_into('i', self._mmap, self._used, len(encoded))
+        self._mmap[self._used + 4:self._used + 4 + len(encoded)] = encoded
+        struct.pack_into('d', self._mmap, position, 0.0)
+        self._used = position + 8
+        struct.pack_into('i', self._mmap, 0, self._used)
+        self._positions[key] = position
+        return position
+
+
+def read_entries(data):
+    """
+    Yields the key, the value and the position of the value of the entries of a metrics file.
+    """
+    used = struct.unpack_from('i', data, 0)[0]
+    position = 8
+    while position < used:
+        length = struct.unpack_from('i', data, position)[0]
+        key = bytes(data[position + 4:position + 4 + length]).decode()
+        position += 4 + length
+        position += -position % 8
+        yield key, struct.unpack_from('d', data, position)[0], position
+        position += 8
+
+
+_metrics_file = None
+_metrics_file_lock = threading.Lock()
+
+
+def get_metrics_file() -> MetricsFile:
+    """
+    Returns the metrics file of the current process, the processes forked from this one get their own file.
+    """
+    global _metrics_file
+    pid = os.getpid()
+    if _metrics_file is None or _metrics_file.path != _metrics_file_path(pid):
+        with _metrics_file_lock:
+            if _metrics_file is None or _metrics_file.path != _metrics_file_path(pid):
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                _metrics_file = MetricsFile(_metrics_file_path(pid))
+    return _metrics_file
+
+
+def _metrics_file_path(pid: int) -> str:
+    return os.path.join(settings.METRICS_DIR, 'metrics_{}.db'.format(pid))
+
+
+def _key(name: str, labels: dict) -> str:
+    return json.dumps([name, labels], sort_keys=True)
+
+
+def _observe(metrics_file: MetricsFile, name: str, labels: dict, value: float, buckets: tuple):
+    for bucket in buckets:
+        if value <= bucket:
+            metrics_file.increment(_key(name + '_bucket', dict(labels, le=str(bucket))))
+    metrics_file.increment(_key(name + '_bucket', dict(labels, le='+Inf')))
+    metrics_file.increment(_key(name + '_sum', labels), value)
+    metrics_file.increment(_key(name + '_count', labels))
+
+
+def record_request(view: str, status_code: int, duration: float, db_queries: int, db_duration: float,
+                   response_size: int | None):
+    """
+    Records the metrics of a request in the metrics file of the process.
+    """
+    metrics_file = get_metrics_file()
+    labels = {'view': view}
+    metrics_file.increment(_key('hajni_courses_requests_total', dict(labels, status=str(status_code))))
+    _observe(metrics_file, 'hajni_courses_request_duration_seconds', labels, duration, METRICS_DURATION_BUCKETS)
+    _observe(metrics_file, 'hajni_courses_request_db_queries', labels, db_queries, METRICS_DB_QUERIES_BUCKETS)
+    metrics_file.increment(_key('hajni_courses_request_db_duration_seconds', labels), db_duration)
+    if response_size is not None:
+        _observe(metrics_file, 'hajni_courses_response_size_bytes', labels, response_size,
+                 METRICS_RESPONSE_SIZE_BUCKETS)
+
+
+def collect() -> dict[str, float]:
+    """
+    Returns the values of the metrics summed over the metrics files of all the processes.
+    """
+    values = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics_*.db')):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < 8:
+            continue
+        for key, value, _position in read_entries(data):
+            values[key] = values.get(key, 0) + value
+    return values
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                          for name, value in labels.items()) + '}'
+
+
+def _sample_order(sample: tuple):
+    name, labels, _value = sample
+    suffix = next((i for i, suffix in enumerate(HISTOGRAM_SUFFIXES) if name.endswith(suffix)), 0)
+    return sorted((key, value) for key, value in labels.items() if key != 'le'), suffix, float(labels.get('le', 0))
+
+
+def render_metrics(values: dict[str, float]) -> str:
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    samples = {name: [] for name in METRICS}
+    for key, value in values.items():
+        name, labels = json.loads(key)
+        family = next((name.removesuffix(suffix) for suffix in HISTOGRAM_SUFFIXES
+                       if name.removesuffix(suffix) in METRICS), name)
+        if family in samples:
+            samples[family].append((name, labels, value))
+    lines = []
+    for family, (metric_type, help_text) in METRICS.items():
+        if not samples[family]:
+            continue
+        lines.append('# HELP {} {}'.format(family, help_text))
+        lines.append('# TYPE {} {}'.format(family, metric_type))
+        for name, labels, value in sorted(samples[family], key=_sample_order):
+            lines.append('{}{} {}'.format(name, _format_labels(labels), repr(float(value))))
+    return '\n'.join(lines) + '\n'
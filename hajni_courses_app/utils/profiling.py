@@ -0,0 +1,55 @@
+import io
+import os
+import pstats
+import time
+from django.conf import settings
+from django.utils import timezone
+
+from hajni_courses_app.utils.constants import PROFILING_REPORT_LINES
+
+
+def get_user_type(request) -> str:
+    """
+    Returns the type of the user of the request, without identifying the user.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_superuser:
+        return 'superuser'
+    return 'staff' if user.is_staff else 'user'
+
+
+def save_profile(profiler, request, response, duration: float) -> str:
+    """
+    Saves the report of the profile of a slow request into PROFILING_DIR, and deletes the oldest reports above
+    PROFILING_MAX_FILES. Returns the path of the report.
+    """
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILING_REPORT_LINES)
+    view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+    header = ['Time: {}'.format(timezone.now().isoformat()),
+              'Request: {} {}'.format(request.method, request.get_full_path()),
+              'View: {}'.format(view),
+              'User: {}'.format(get_user_type(request)),
+              'Status: {}'.format(response.status_code),
+              'Duration: {:.3f} s'.format(duration)]
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILING_DIR, 'profile_{}_{}.txt'.format(time.time_ns(), os.getpid()))
+    with open(path, 'w', encoding='utf-8') as report:
+        report.write('\n'.join(header) + '\n' + stream.getvalue())
+    prune_profiles()
+    return path
+
+
+def prune_profiles():
+    """
+    Deletes the oldest profile reports above PROFILING_MAX_FILES.
+    """
+    reports = sorted(name for name in os.listdir(settings.PROFILING_DIR)
+                     if name.startswith('profile_') and name.endswith('.txt'))
+    for name in reports[:max(len(reports) - settings.PROFILING_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, name))
+        except FileNotFoundError:  # deleted by another process
+            pass
@@ -0,0 +1,91 @@
+import os
+import re
+import sys
+import time
+from django.conf import settings
+
+from hajni_courses.logger import logger
+from hajni_courses_app.utils.constants import SQL_LOGGED_LENGTH, SQL_STACK_DEPTH
+
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# files of the app wrapping every query, left out of the call stacks
+SKIPPED_FILES = (__file__, os.path.join(APP_DIRECTORY, 'middleware.py'))
+# the placeholders of the IN lists, their number depends on the values
+IN_LIST_PATTERN = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class RepeatedQueryError(Exception):
+    """
+    Raised at the end of a request repeating the same query (N+1 queries) while SQL_REPEATED_QUERY_RAISE is set.
+    """
+
+
+def get_query_shape(sql: str) -> str:
+    """
+    Returns the SQL of a query without its IN list lengths, the parameters are not part of the SQL.
+    """
+    return IN_LIST_PATTERN.sub('IN (...)', sql)
+
+
+def get_app_stack() -> str:
+    """
+    Returns the innermost frames of the call stack in the code of the app, e.g.
+    `models.py:70 delete_user_profile < views.py:196 post`.
+    """
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < SQL_STACK_DEPTH:
+        file_name = frame.f_code.co_filename
+        if file_name.startswith(APP_DIRECTORY) and file_name not in SKIPPED_FILES:
+            frames.append('{}:{} {}'.format(os.path.relpath(file_name, APP_DIRECTORY), frame.f_lineno,
+                                            frame.f_code.co_name))
+        frame = frame.f_back
+    return ' < '.join(frames) or 'outside of the app'
+
+
+class QueryInspector:
+    """
+    Database execute wrapper logging the queries slower than SQL_SLOW_QUERY_THRESHOLD seconds, and counting the
+    queries of the same shape, so the ones repeated at least SQL_REPEATED_QUERY_THRESHOLD times can be reported.
+    """
+
+    def __init__(self):
+        # shape -> number of queries
+        self.counts = {}
+        # shape -> call stack of the query reaching the threshold
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= settings.SQL_SLOW_QUERY_THRESHOLD:
+                logger.warning('Slow query ({:.3f} s) at {}: {}'.format(duration, get_app_stack(),
+                                                                       sql[:SQL_LOGGED_LENGTH]))
+            shape = get_query_shape(sql)
+            self.counts[shape] = self.counts.get(shape, 0) + 1
+            if self.counts[shape] == settings.SQL_REPEATED_QUERY_THRESHOLD:
+                self.stacks[shape] = get_app_stack()
+
+    def get_repeated_queries(self) -> list[str]:
+        """
+        Returns the descriptions of the queries repeated at least SQL_REPEATED_QUERY_THRESHOLD times.
+        """
+        return ['{} times at {}: {}'.format(self.counts[shape], stack, shape[:SQL_LOGGED_LENGTH])
+                for shape, stack in self.stacks.items()]
+
+    def report(self, request):
+        """
+        Logs the repeated queries of the request, or raises RepeatedQueryError while SQL_REPEATED_QUERY_RAISE is set.
+        """
+        repeated_queries = self.get_repeated_queries()
+        if not repeated_queries:
+            return
+        message = 'Repeated queries (N+1) in {} {}:\n{}'.format(request.method, request.path,
+                                                                 '\n'.join(repeated_queries))
+        if settings.SQL_REPEATED_QUERY_RAISE:
+            raise RepeatedQueryError(message)
+        logger.warning(message)
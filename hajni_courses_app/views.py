@@ -1,12 +1,17 @@
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 from django.shortcuts import redirect, render
 from django.shortcuts import get_object_or_404
@@ -14,11 +19,15 @@ from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
-import os
 
 from hajni_courses.logger import logger
 from hajni_courses_app.utils.AccountActivationTokenGenerator import account_activation_token
-from hajni_courses_app.utils.constants import PAGINATION_PAGES, COURSES_PER_PAGE
+from hajni_courses_app.utils.conditional import course_etag, course_last_modified, course_list_etag, \
+    download_etag, download_last_modified
+from hajni_courses_app.utils.course_listing import CourseListing
+from hajni_courses_app.utils.downloads import get_manifest as get_downloads_manifest, get_file as get_downloadable_file, \
+    get_group as get_download_group, file_response, zip_response
+from hajni_courses_app.utils.metrics import collect as collect_metrics, render_metrics
 from .forms import SignUpForm, LoginForm, PersonalDataForm, ApplyForm
 from .models import CustomUser, Course
 
@@ -34,8 +43,7 @@ class HomePage(TemplateView):
         Overriding the get_context_data method to add the superuser email.
         """
         context = super().get_context_data(**kwargs)
-        superusers_emails = CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True)
-        context["superusers_emails"] = '; '.join(superusers_emails)
+        context["superusers_emails"] = '; '.join(CustomUser.get_admin_emails())
 
         context['bold_start'] = mark_safe('<b>')
         context['bold_end'] = mark_safe('</b>')
@@ -69,10 +77,11 @@ def sign_up(request):
         if form.is_valid():
             user = form.save(commit=False)
             user.is_active = False
-            user.save()
-            # sending the email to confirm the registration
-            user.send_activation_link(get_current_site(request).domain,
-                                      'https' if request.is_secure() else 'http')
+            with transaction.atomic():
+                user.save()
+                # queuing the email to confirm the registration
+                user.send_activation_link(get_current_site(request).domain,
+                                          'https' if request.is_secure() else 'http')
             logger.info('New user signed up: {}, {}'.format(user.pk, user.username))
             messages.success(request, _("A fiókodat sikeresen létrehoztuk, kérlek fejezd be a regisztrációt az "
                                         "emailben küldött aktivációs linkre kattintással."))
@@ -153,9 +162,10 @@ def personal_data(request):
                 # if the email has changed, we send an activation mail to the user to confirm their new email address
                 user.email = form.cleaned_data['email']
                 user.is_active = False
-                user.save()
-                user.send_activation_link(get_current_site(request).domain,
-                                          'https' if request.is_secure() else 'http')
+                with transaction.atomic():
+                    user.save()
+                    user.send_activation_link(get_current_site(request).domain,
+                                              'https' if request.is_secure() else 'http')
                 redirect('logout')
                 messages.success(request, _("Az adataidat sikeresen frissítettük és küldtünk egy emailt, hogy meg tudd "
                                             "erősíteni az új email címedet."))
@@ -195,80 +205,59 @@ class DeleteProfileView(LoginRequiredMixin, TemplateView):
         return self.render_to_response(context)
 
 
-class PensionerCoursesListPage(TemplateView):
+@method_decorator(condition(etag_func=course_list_etag), name='get')
+class CourseListPage(TemplateView):
     """
-    View class for the pensioner course list.
+    Base view class for the course lists. The subclasses declare the audience and the filter of their courses.
+    Unchanged pages are answered with 304 Not Modified by their ETag, they have no Last-Modified, as the time of the
+    last course change does not change when a course is deleted.
     """
-    template_name = "pensioner_courses.html"
+    audience: str = None
+    course_filter: Q = None
 
     def get_context_data(self, **kwargs):
         """
-        Overriding the get_context_data method to add the list of active Courses.
+        Overriding the get_context_data method to add the rendered page of the Courses.
         """
         context = super().get_context_data(**kwargs)
-        courses = Course.objects.filter((Q(active=True) & Q(for_pensioners=True))).order_by('id')
-
-        page_number = int(self.request.GET.get('page', 1))
-        paginator = Paginator(courses, COURSES_PER_PAGE)
-        page = paginator.get_page(page_number)
-        context["page"] = page
-        context["courses"] = page.object_list
-
-        pages_before_after = int(PAGINATION_PAGES / 2)
-        if paginator.num_pages <= PAGINATION_PAGES:
-            pages = [i for i in range(1, paginator.num_pages + 1)]
-        elif paginator.num_pages - page.number < pages_before_after:
-            pages = [i for i in range(paginator.num_pages - PAGINATION_PAGES + 1, paginator.num_pages + 1)]
-        elif page.number - pages_before_after <= 0:
-            pages = [i for i in range(1, PAGINATION_PAGES + 1)]
-        else:
-            pages = [i for i in range(page.number - pages_before_after, page.number + pages_before_after + 1)]
-        context["pages"] = pages
-
+        listing = CourseListing(self.audience, self.course_filter)
+        context["course_list"] = listing.render_page(self.request.GET.get('page'), self.request.GET.get('after'))
         return context
 
 
-class GeneralCoursesListPage(TemplateView):
+class PensionerCoursesListPage(CourseListPage):
+    """
+    View class for the pensioner course list.
+    """
+    template_name = "pensioner_courses.html"
+    audience = 'pensioners'
+    course_filter = Q(active=True) & Q(for_pensioners=True)
+
+
+class GeneralCoursesListPage(CourseListPage):
     """
     View class for the general course list.
     """
     template_name = "general_courses.html"
+    audience = 'non_pensioners'
+    course_filter = Q(active=True) & Q(for_non_pensioners=True)
 
     def get_context_data(self, **kwargs):
         """
-        Overriding the get_context_data method to add the list of active Courses.
+        Overriding the get_context_data method to add the formatting of the texts.
         """
         context = super().get_context_data(**kwargs)
-        courses = Course.objects.filter((Q(active=True) & Q(for_non_pensioners=True))).order_by('id')
-
-        page_number = int(self.request.GET.get('page', 1))
-        paginator = Paginator(courses, COURSES_PER_PAGE)
-        page = paginator.get_page(page_number)
-        context["page"] = page
-        context["courses"] = page.object_list
-
-        pages_before_after = int(PAGINATION_PAGES / 2)
-        if paginator.num_pages <= PAGINATION_PAGES:
-            pages = [i for i in range(1, paginator.num_pages + 1)]
-        elif paginator.num_pages - page.number < pages_before_after:
-            pages = [i for i in range(paginator.num_pages - PAGINATION_PAGES + 1, paginator.num_pages + 1)]
-        elif page.number - pages_before_after <= 0:
-            pages = [i for i in range(1, PAGINATION_PAGES + 1)]
-        else:
-            pages = [i for i in range(page.number - pages_before_after, page.number + pages_before_after + 1)]
-        context["pages"] = pages
-
         context['bold_start'] = mark_safe('<b>')
         context['bold_end'] = mark_safe('</b>')
         context['a_start'] = mark_safe('<a href="" style="color: blue;">')
         context['a_end'] = mark_safe('</a>')
-
         return context
 
 
+@method_decorator(condition(etag_func=course_etag, last_modified_func=course_last_modified), name='get')
 class CoursePage(TemplateView):
     """
-    View class for the course.
+    View class for the course. An unchanged course page is answered with 304 Not Modified.
     """
     template_name = "course.html"
 
@@ -328,31 +317,52 @@ class PrivacyNoticePage(TemplateView):
         Overriding the get_context_data method to add the superuser email.
         """
         context = super().get_context_data(**kwargs)
-        superusers_emails = CustomUser.objects.filter(is_superuser=True).values_list('email', flat=True)
-        context["superusers_emails"] = '; '.join(superusers_emails)
+        context["superusers_emails"] = '; '.join(CustomUser.get_admin_emails())
         return context
 
 
 def downloads_view(request):
-    base_path = os.path.join(settings.MEDIA_ROOT, "files")
-    base_url = os.path.join(settings.MEDIA_URL, "files")
+    """
+    View method for the downloads.
+    """
+    return render(request, "downloads.html", {"file_groups": get_downloads_manifest()['file_groups']})
 
-    file_groups = []
 
-    if os.path.exists(base_path):
-        for folder_name in sorted(os.listdir(base_path)):
-            folder_path = os.path.join(base_path, folder_name)
-            if os.path.isdir(folder_path):
-                group_name = folder_name.replace("_", " ").title()
+@login_required(login_url='login')
+@condition(etag_func=download_etag, last_modified_func=download_last_modified)
+def download_file(request, sha256, file_name):
+    """
+    View method to download a file, only for the users logged in. Interrupted downloads can be resumed with
+    Range requests.
+    """
+    file = get_downloadable_file(sha256, file_name)
+    if file is None:
+        raise Http404
+    try:
+        return file_response(request, file)
+    except FileNotFoundError:
+        raise Http404
 
-                files = []
-                for file_name in sorted(os.listdir(folder_path)):
-                    file_path = os.path.join(folder_path, file_name)
-                    if os.path.isfile(file_path):
-                        file_url = f"{base_url}/{folder_name}/{file_name}"
-                        files.append({"name": file_name, "url": file_url})
 
-                if files:
-                    file_groups.append({"name": group_name, "files": files})
+@login_required(login_url='login')
+def download_group(request, group_name):
+    """
+    View method to download all the files of a group in one ZIP archive, only for the users logged in.
+    """
+    group = get_download_group(group_name)
+    if group is None:
+        raise Http404
+    return zip_response(group)
 
-    return render(request, "downloads.html", {"file_groups": file_groups})
+
+@never_cache
+def metrics_view(request):
+    """
+    View method for the request metrics of all the worker processes in the Prometheus text format, only for the
+    staff users and the clients sending the METRICS_TOKEN.
+    """
+    authorized = settings.METRICS_TOKEN and \
+        constant_time_compare(request.headers.get('Authorization', ''), 'Bearer {}'.format(settings.METRICS_TOKEN))
+    if not settings.METRICS_DIR or not (authorized or request.user.is_staff):
+        raise Http404
+    return HttpResponse(render_metrics(collect_metrics()), content_type='text/plain; version=0.0.4; charset=utf-8')